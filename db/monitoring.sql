@@ -8,6 +8,10 @@ CREATE TABLE IF NOT EXISTS `data` (
     `available_disk_space` FLOAT NOT NULL,
     `apache_requests` INT NOT NULL,
     `response_time` INT,
+    `response_time_p50` INT,
+    `response_time_p90` INT,
+    `response_time_p99` INT,
+    `response_time_max` INT,
     `solr_solr_cpu` FLOAT,
     `solr_solr_mem` FLOAT,
     `solr_cron_cpu` FLOAT,
@@ -17,10 +21,136 @@ CREATE TABLE IF NOT EXISTS `data` (
     `catalog_catalog_cpu` FLOAT,
     `catalog_catalog_mem` FLOAT,
     `mariadb_galera_cpu` FLOAT,
-    `mariadb_galera_mem` FLOAT
+    `mariadb_galera_mem` FLOAT,
+    `load_average` FLOAT,
+    `cpu_pressure` FLOAT,
+    `memory_pressure` FLOAT,
+    `io_pressure` FLOAT,
+    `disk_read_rate` FLOAT,
+    `disk_write_rate` FLOAT
 );
 
-CREATE INDEX IF NOT EXISTS idx_time ON data(time);
+-- Columns added after the initial release, for existing databases
+ALTER TABLE `data`
+    ADD COLUMN IF NOT EXISTS `response_time_p50` INT AFTER `response_time`,
+    ADD COLUMN IF NOT EXISTS `response_time_p90` INT AFTER `response_time_p50`,
+    ADD COLUMN IF NOT EXISTS `response_time_p99` INT AFTER `response_time_p90`,
+    ADD COLUMN IF NOT EXISTS `response_time_max` INT AFTER `response_time_p99`,
+    ADD COLUMN IF NOT EXISTS `load_average` FLOAT,
+    ADD COLUMN IF NOT EXISTS `cpu_pressure` FLOAT AFTER `load_average`,
+    ADD COLUMN IF NOT EXISTS `memory_pressure` FLOAT AFTER `cpu_pressure`,
+    ADD COLUMN IF NOT EXISTS `io_pressure` FLOAT AFTER `memory_pressure`,
+    ADD COLUMN IF NOT EXISTS `disk_read_rate` FLOAT AFTER `io_pressure`,
+    ADD COLUMN IF NOT EXISTS `disk_write_rate` FLOAT AFTER `disk_read_rate`;
+
+-- Every query on the data table is for a single node and a time range
+CREATE INDEX IF NOT EXISTS idx_node_time ON data(node, time);
+DROP INDEX IF EXISTS idx_time ON data;
+
+-- Per-minute requests, bytes sent and response times for each family of routes
+-- (response time histograms are in microseconds)
+CREATE TABLE IF NOT EXISTS `route_data` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `route` VARCHAR(20) NOT NULL,
+    `request_count` INT NOT NULL,
+    `bytes_sent` BIGINT NOT NULL DEFAULT 0,
+    `response_time` INT,
+    `response_time_max` INT,
+    `histogram` TEXT NOT NULL,
+    PRIMARY KEY (`node`, `route`, `time`)
+);
+
+-- Per-minute metrics for each container of the stack, read from the cgroup files
+-- (stale: no rates yet for the container, or it stopped since the previous minute)
+CREATE TABLE IF NOT EXISTS `container_data` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `container` VARCHAR(100) NOT NULL,
+    `cpu_percent` FLOAT,
+    `memory_bytes` BIGINT,
+    `memory_percent` FLOAT,
+    `io_read_rate` FLOAT,
+    `io_write_rate` FLOAT,
+    `throttled_percent` FLOAT,
+    `stale` BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (`node`, `container`, `time`),
+    KEY `idx_node_time` (`node`, `time`)
+);
+
+-- Rollups of the data and route_data tables, maintained by the monitoring app
+-- (one row per node, variable or route, and hour/day/month)
+CREATE TABLE IF NOT EXISTS `data_hourly` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `variable` VARCHAR(40) NOT NULL,
+    `min_value` FLOAT,
+    `max_value` FLOAT,
+    `avg_value` FLOAT,
+    `sample_count` INT NOT NULL,
+    PRIMARY KEY (`node`, `variable`, `time`)
+);
+
+CREATE TABLE IF NOT EXISTS `data_daily` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `variable` VARCHAR(40) NOT NULL,
+    `min_value` FLOAT,
+    `max_value` FLOAT,
+    `avg_value` FLOAT,
+    `sample_count` INT NOT NULL,
+    PRIMARY KEY (`node`, `variable`, `time`)
+);
+
+CREATE TABLE IF NOT EXISTS `data_monthly` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `variable` VARCHAR(40) NOT NULL,
+    `min_value` FLOAT,
+    `max_value` FLOAT,
+    `avg_value` FLOAT,
+    `sample_count` INT NOT NULL,
+    PRIMARY KEY (`node`, `variable`, `time`)
+);
+
+CREATE TABLE IF NOT EXISTS `route_data_hourly` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `route` VARCHAR(20) NOT NULL,
+    `request_count` INT NOT NULL,
+    `bytes_sent` BIGINT NOT NULL DEFAULT 0,
+    `response_time` INT,
+    `response_time_max` INT,
+    `histogram` TEXT NOT NULL,
+    `sample_count` INT NOT NULL,
+    PRIMARY KEY (`node`, `route`, `time`)
+);
+
+CREATE TABLE IF NOT EXISTS `route_data_daily` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `route` VARCHAR(20) NOT NULL,
+    `request_count` INT NOT NULL,
+    `bytes_sent` BIGINT NOT NULL DEFAULT 0,
+    `response_time` INT,
+    `response_time_max` INT,
+    `histogram` TEXT NOT NULL,
+    `sample_count` INT NOT NULL,
+    PRIMARY KEY (`node`, `route`, `time`)
+);
+
+CREATE TABLE IF NOT EXISTS `route_data_monthly` (
+    `node` INT NOT NULL,
+    `time` DATETIME NOT NULL,
+    `route` VARCHAR(20) NOT NULL,
+    `request_count` INT NOT NULL,
+    `bytes_sent` BIGINT NOT NULL DEFAULT 0,
+    `response_time` INT,
+    `response_time_max` INT,
+    `histogram` TEXT NOT NULL,
+    `sample_count` INT NOT NULL,
+    PRIMARY KEY (`node`, `route`, `time`)
+);
 
 GRANT ALL PRIVILEGES ON monitoring.* TO 'monitoring'@'%' identified by '${MARIADB_MONITORING_PASSWORD}';
 
@@ -0,0 +1,290 @@
+'''Incremental Apache access log analyzer'''
+import os
+import re
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import log_index # pylint: disable=import-error
+from histogram import Histogram # pylint: disable=import-error
+
+
+READ_CHUNK_SIZE = 1024*1024
+# Maximum number of bytes read back from the end of the log when the analyzer starts
+MAX_INITIAL_READ = 10240000
+# Number of minutes kept in memory, in case the collector is late
+KEEP_MINUTES = 5
+# Apache "combined" format with the response time in microseconds at the end (%D):
+# minute, path, status, bytes sent, user agent, response time.
+# The path is missing when the request line is "-" (like with a 408 timeout).
+LINE_PATTERN = re.compile(
+    rb'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d):\d\d [^\]]*\] "(?:\S+ (\S+)[^"]*|[^"]*)" (\d{3}) (\S+) '
+    rb'"(?:[^"\\]|\\.)*" "((?:[^"\\]|\\.)*)" (\d+)$'
+)
+BOT_PATTERN = re.compile(
+    rb'bot|crawl|spider|slurp|scrapy|facebookexternalhit|python|aiohttp|curl|wget|go-http-client|'
+    rb'java/|libwww',
+    re.IGNORECASE
+)
+STATIC_PREFIXES = (b'/themes/', b'/cache/', b'/assets/', b'/Cover/')
+STATIC_EXTENSIONS = (
+    b'.css', b'.js', b'.map', b'.png', b'.jpg', b'.jpeg', b'.gif', b'.svg', b'.ico', b'.woff',
+    b'.woff2', b'.ttf', b'.eot'
+)
+ROUTE_CLASSES = [
+    'search', 'record', 'alphabrowse', 'home', 'static', 'bot_search', 'bot', 'error', 'other'
+]
+PERCENTILES = [50, 90, 99]
+
+
+def route_class(path: bytes, status: int = 200, user_agent: bytes = b'') -> str: # pylint: disable=too-many-return-statements
+    '''
+    Get the family of route for a request. Bots come first, with their searches apart
+    (bot_search) so that a crawler burst on the most expensive route is visible without
+    changing the search response times of the users. Then the searches of the users,
+    including the errors, and the errors (4xx and 5xx), so that the other VuFind route
+    families only count successful user traffic.
+    Args:
+        path (bytes): Requested path, including the query string
+        status (int): HTTP status code of the response
+        user_agent (bytes): User agent of the client
+    Returns:
+        (str): One of ROUTE_CLASSES
+    '''
+    if BOT_PATTERN.search(user_agent):
+        return 'bot_search' if path.startswith(b'/Search/Results') else 'bot'
+    if path.startswith(b'/Search/Results'):
+        return 'search'
+    if status >= 400:
+        return 'error'
+    if path.startswith(b'/Record/'):
+        return 'record'
+    if path.startswith(b'/Alphabrowse/Home'):
+        return 'alphabrowse'
+    if path in (b'/', b'/Search/Home') or path.startswith((b'/?', b'/Search/Home?')):
+        return 'home'
+    if path.startswith(STATIC_PREFIXES) or path.split(b'?', 1)[0].endswith(STATIC_EXTENSIONS):
+        return 'static'
+    return 'other'
+
+
+class RouteStats():
+    '''
+    Statistics for the requests to a family of routes within a minute
+    '''
+    def __init__(self):
+        self.histogram = Histogram()
+        self.bytes_sent = 0
+        self.response_time_total = 0
+
+    def add(self, bytes_sent: int, time_micro: int):
+        '''
+        Record a request
+        Args:
+            bytes_sent (int): Number of bytes sent to the client
+            time_micro (int): Time taken to serve the request, in microseconds
+        '''
+        self.histogram.record(time_micro)
+        self.bytes_sent += bytes_sent
+        self.response_time_total += time_micro
+
+    def results(self) -> dict:
+        '''
+        Get the statistics to save
+        Returns:
+            (dict): Request count, bytes sent, average response time in ms, maximum
+                response time and histogram in microseconds
+        '''
+        return {
+            'request_count': self.histogram.total,
+            'bytes_sent': self.bytes_sent,
+            'response_time': None if self.histogram.total == 0 else
+                self.response_time_total // self.histogram.total // 1000,
+            'response_time_max': self.histogram.max,
+            'histogram': self.histogram.encode(),
+        }
+
+
+class MinuteStats():
+    '''
+    Statistics for the requests logged within a minute
+    '''
+    def __init__(self):
+        self.request_count = 0
+        self.response_time_total = 0
+        self.response_time_count = 0
+        self.routes = {route: RouteStats() for route in ROUTE_CLASSES}
+
+    def add(self, path: bytes, status: int, bytes_sent: int, user_agent: bytes, time_micro: int): # pylint: disable=too-many-arguments,too-many-positional-arguments,line-too-long
+        '''
+        Record a request; the average search response time covers the same requests as
+        the search histogram (the searches of the users, see route_class)
+        Args:
+            path (bytes): Requested path, including the query string
+            status (int): HTTP status code of the response
+            bytes_sent (int): Number of bytes sent to the client
+            user_agent (bytes): User agent of the client
+            time_micro (int): Time taken to serve the request, in microseconds
+        '''
+        self.request_count += 1
+        route = route_class(path, status, user_agent)
+        if route == 'search':
+            self.response_time_count += 1
+            self.response_time_total += time_micro // 1000
+        self.routes[route].add(bytes_sent, time_micro)
+
+    def results(self) -> dict:
+        '''
+        Get the statistics to save
+        Returns:
+            (dict): Request count, average search response time in ms, search response time
+                percentiles and maximum in ms, and statistics for each family of routes
+        '''
+        results = {
+            'request_count': self.request_count,
+            'response_time': None if self.response_time_count == 0 else
+                self.response_time_total // self.response_time_count,
+        }
+        search = self.routes['search'].histogram
+        for percent in PERCENTILES:
+            value = search.percentile(percent)
+            results[f'response_time_p{percent}'] = None if value is None else value // 1000
+        results['response_time_max'] = None if search.max is None else search.max // 1000
+        results['routes'] = {route: stats.results() for route, stats in self.routes.items()}
+        return results
+
+
+class AccessLogAnalyzer(): # pylint: disable=too-many-instance-attributes
+    '''
+    Follow the access log like `tail -F`, parsing only the bytes appended since the previous
+    update, and keep request statistics per minute.
+    The file stays open between updates so that the end of a rotated file is still read;
+    a change of inode or a truncation is detected after reading.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._inode = None
+        self._partial = b''
+        self._started = False
+        self._minutes: dict[str, MinuteStats] = {}
+        self._minute_times: dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def _open(self):
+        try:
+            self._file = open(self.path, 'rb') # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            return
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        self._partial = b''
+        if not self._started:
+            # First time: avoid parsing the whole file, starting from the minutes kept, but
+            # never reading more than MAX_INITIAL_READ (the index may lag far behind the file)
+            start = log_index.start_offset(
+                self.path, datetime.now() - timedelta(minutes=KEEP_MINUTES)
+            ) or 0
+            if start < stat.st_size - MAX_INITIAL_READ:
+                # Read the end of the file, and skip the first partial line
+                self._file.seek(stat.st_size - MAX_INITIAL_READ)
+                self._file.readline()
+            else:
+                self._file.seek(start)
+        self._started = True
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._inode = None
+        self._partial = b''
+
+    def _parse_line(self, line: bytes):
+        match = LINE_PATTERN.search(line)
+        if not match:
+            return
+        minute = match.group(1).decode('ascii')
+        stats = self._minutes.get(minute)
+        if stats is None:
+            stats = self._minutes[minute] = MinuteStats()
+        bytes_sent = match.group(4)
+        stats.add(
+            match.group(2) or b'', int(match.group(3)),
+            int(bytes_sent) if bytes_sent.isdigit() else 0, match.group(5), int(match.group(6))
+        )
+
+    def _read_new_data(self):
+        while True:
+            chunk = self._file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (self._partial + chunk).split(b'\n')
+            self._partial = lines.pop()
+            for line in lines:
+                self._parse_line(line.rstrip(b'\r'))
+
+    def _file_replaced(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_ino != self._inode:
+            return True
+        if stat.st_size < self._file.tell():
+            # Truncated in place (copytruncate)
+            self._file.seek(0)
+            self._partial = b''
+        return False
+
+    def _minute_time(self, minute: str) -> datetime | None:
+        if minute not in self._minute_times:
+            try:
+                self._minute_times[minute] = datetime.strptime(minute, '%d/%b/%Y:%H:%M')
+            except ValueError:
+                self._minute_times[minute] = None
+        return self._minute_times[minute]
+
+    def _prune(self, now: datetime):
+        limit = now - timedelta(minutes=KEEP_MINUTES)
+        for minute in list(self._minutes):
+            minute_time = self._minute_time(minute)
+            if minute_time is None or minute_time < limit:
+                del self._minutes[minute]
+                self._minute_times.pop(minute, None)
+
+    def update(self):
+        '''
+        Parse the lines appended to the log since the last update
+        '''
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                    if self._file is None:
+                        return
+                self._read_new_data()
+                if self._file_replaced():
+                    # Rotated: the end of the old file has been read, continue with the new one
+                    self._close()
+                    self._open()
+                    if self._file is not None:
+                        self._read_new_data()
+                else:
+                    self._read_new_data()
+            except OSError as err:
+                print(f"Error reading the apache log file: {err}", file=sys.stderr)
+                self._close()
+            self._prune(datetime.now())
+
+    def minute_results(self, minute: datetime) -> dict:
+        '''
+        Get the statistics for a given minute
+        Args:
+            minute (datetime): Any time within the minute
+        Returns:
+            (dict): Statistics, see MinuteStats.results
+        '''
+        with self._lock:
+            stats = self._minutes.get(minute.strftime('%d/%b/%Y:%H:%M'), MinuteStats())
+            return stats.results()
@@ -1,73 +1,153 @@
 '''App entrypoint'''
 import os
-import flask
+import asyncio
+import quart
+import uvicorn
 
 import collector # pylint: disable=import-error
 import graphs # pylint: disable=import-error
 import home # pylint: disable=import-error
+import log_search # pylint: disable=import-error
+import log_tail # pylint: disable=import-error
 import logs # pylint: disable=import-error
 import status # pylint: disable=import-error
 
 
 debug = not os.getenv('STACK_NAME', '').endswith('-prod')
-app = flask.Flask(__name__, static_url_path='/monitoring/static')
+app = quart.Quart(__name__, static_url_path='/monitoring/static')
+app.debug = debug
 
 # Initialize stats collector with a scheduler
 
-collector.init(debug)
+collector.init()
 
 # Routes
+# Blocking work (database queries, file reads, cached status probes) runs in threads
+# with asyncio.to_thread, so the event loop keeps serving the other requests
 
 # Homepage and status
 
 @app.route('/monitoring/node/status')
-def node_status():
+async def node_status():
     '''
     Get the node status data
     '''
-    return status.get_node_status()
+    return await asyncio.to_thread(status.get_node_status)
 
 @app.route('/monitoring')
-def homepage():
+async def homepage():
     '''
     Render the home page
     '''
-    return home.homepage() # pylint: disable=c-extension-no-member
+    return await home.homepage()
 
 # Logs
 
 @app.route('/monitoring/node/logs/<path:service>')
-def node_logs(service):
+async def node_logs(service):
     '''
-    Get the logs for the service on the node
+    Get the logs for the service on the node, or a page of one of its files
     '''
-    return logs.node_logs(service)
+    args = quart.request.args
+    if not any(name in args for name in logs.PAGE_PARAMETERS):
+        return quart.Response(logs.node_logs_stream(service), mimetype='text/plain')
+    return await asyncio.to_thread(logs.node_log_page, service, args)
 
 @app.route('/monitoring/logs/<path:service>')
-def logs_vufind(service):
+async def logs_vufind(service):
     '''
     Get the logs for the requested service
     '''
-    return logs.logs_vufind(service)
+    return quart.Response(await logs.logs_vufind(service, 'full' in quart.request.args))
+
+@app.route('/monitoring/log_page/<int:node>/<path:service>')
+async def log_page(node, service):
+    '''
+    Get a page of the logs for the requested service from a node
+    '''
+    return await logs.log_page(node, service, quart.request.args)
+
+@app.route('/monitoring/node/logs/<path:service>/tail')
+async def node_logs_tail(service):
+    '''
+    Follow the log for the service on the node, with Server-Sent Events
+    '''
+    response = quart.Response(
+        log_tail.node_tail(service, quart.request.headers.get('Last-Event-ID')),
+        mimetype='text/event-stream', headers=log_tail.SSE_HEADERS
+    )
+    response.timeout = None
+    return response
+
+@app.route('/monitoring/logs/<path:service>/tail')
+async def logs_tail(service):
+    '''
+    Follow the log for the requested service on all the nodes, with Server-Sent Events
+    '''
+    response = quart.Response(
+        log_tail.tail(service, quart.request.headers.get('Last-Event-ID')),
+        mimetype='text/event-stream', headers=log_tail.SSE_HEADERS
+    )
+    response.timeout = None
+    return response
+
+@app.route('/monitoring/node/log_search/<path:service>')
+async def node_log_search(service):
+    '''
+    Search the logs for the service on the node
+    '''
+    return await asyncio.to_thread(
+        log_search.node_log_search, service, quart.request.args
+    )
+
+@app.route('/monitoring/log_search/<path:service>')
+async def log_search_vufind(service):
+    '''
+    Search the logs for the requested service on all the nodes
+    '''
+    return await log_search.log_search(service, quart.request.args)
 
 # Graphs
 
 @app.route('/monitoring/node/graph_data/<variable>/<period>')
-def node_graph_data(variable, period):
+async def node_graph_data(variable, period):
     '''
     Get the data for the requested graph
     '''
-    return graphs.node_graph_data(variable, period)
+    args = quart.request.args
+    return await asyncio.to_thread(
+        graphs.node_graph_data, variable, period, args.get('route', 'search'), args
+    )
+
+@app.route('/monitoring/graph_data/<period>')
+async def graph_data(period):
+    '''
+    Get the data for several variables, and optionally all the nodes
+    '''
+    args = quart.request.args
+    return await asyncio.to_thread(
+        graphs.graph_data, period, args.get('variables'), args.get('nodes'),
+        args.get('route', 'search'), args
+    )
+
+@app.route('/monitoring/dashboard/<period>')
+async def dashboard(period):
+    '''
+    Render the graphs for all the variables
+    '''
+    args = quart.request.args
+    return await graphs.dashboard(period, args.get('route', 'search'), args)
 
 @app.route('/monitoring/graphs/<variable>/<period>')
-def graph(variable, period):
+async def graph(variable, period):
     '''
     Render the requested graph
     '''
-    return graphs.graph(variable, period)
+    args = quart.request.args
+    return await graphs.graph(variable, period, args.get('route', 'search'), args)
 
 
-# Run the app
+# Run the app (in Docker, uvicorn is started directly, see the Dockerfile)
 
 if __name__ == "__main__":
-    app.run(debug=debug, host='0.0.0.0', port=80)
+    uvicorn.run(app, host='0.0.0.0', port=80)
@@ -0,0 +1,120 @@
+'''
+Check with EXPLAIN that the graph queries use an index for every period, instead of
+scanning whole tables. Run it in a monitoring container: python app/check_graph_queries.py
+'''
+import sys
+from datetime import datetime
+import mariadb as db
+
+import graphs # pylint: disable=import-error
+import util # pylint: disable=import-error
+
+
+# Index expected for each table: the rollup tables and route_data are read with the
+# beginning of their primary key, data with idx_node_time
+EXPECTED_KEYS = {'data': 'idx_node_time'}
+EXPECTED_KEY = 'PRIMARY'
+POINTS = [graphs.DEFAULT_POINTS, graphs.MAX_POINTS]
+
+
+class _ExplainCursor():
+    '''
+    Cursor running EXPLAIN for each query instead of the query itself, and returning no row
+    '''
+    def __init__(self, cur):
+        self._cur = cur
+        self.plans = []
+
+    def execute(self, query: str, params: list):
+        '''
+        Explain a query, and keep its plan
+        Args:
+            query (str): SQL query
+            params (list): Bound parameters
+        '''
+        self._cur.execute(f'EXPLAIN {query}', params)
+        columns = [description[0] for description in self._cur.description]
+        self.plans.append((query, [dict(zip(columns, row)) for row in self._cur.fetchall()]))
+
+    def __iter__(self):
+        return iter(())
+
+
+def _problems(plan: list[dict]) -> list[str]:
+    problems = []
+    for row in plan:
+        expected = EXPECTED_KEYS.get(row['table'], EXPECTED_KEY)
+        if row['type'] in ('ALL', 'index'):
+            problems.append(f"full scan of {row['table']} (type {row['type']})")
+        if row['key'] != expected:
+            problems.append(f"{row['table']} uses key {row['key']} instead of {expected}")
+    return problems
+
+
+def check(cur) -> list[str]:
+    '''
+    Explain the data and route queries of the graphs for each period and number of points
+    Args:
+        cur: Cursor of the monitoring database
+    Returns:
+        (list[str]): Description of the problems found, empty if all the queries use the
+            expected index
+    '''
+    route_variables = graphs.ROUTE_VARIABLES + list(graphs.HISTOGRAM_VARIABLES)
+    data_variables = [
+        variable for variable in graphs.KNOWN_VARIABLES if variable not in route_variables
+    ]
+    problems = []
+    for period in graphs.PERIODS:
+        if period == 'custom':
+            continue
+        for points in POINTS:
+            (period_start, period_end, points) = graphs.graph_window(
+                period, {'points': str(points)}
+            )
+            width = graphs._bucket_width( # pylint: disable=protected-access
+                period_start, period_end, points
+            )
+            selection = {
+                'nodes': graphs.NODES, 'start': period_start, 'end': period_end,
+                'width': width, 'route': 'search',
+            }
+            explain = _ExplainCursor(cur)
+            graphs._read_data_series( # pylint: disable=protected-access
+                explain, data_variables, selection, {}, {}
+            )
+            graphs._read_route_series( # pylint: disable=protected-access
+                explain, route_variables, selection, {}, {}
+            )
+            for (query, plan) in explain.plans:
+                table = query.split(' FROM ', 1)[1].split(' ', 1)[0]
+                for problem in _problems(plan):
+                    problems.append(f'{period}, {points} points, {table}: {problem}')
+                print(f"{period}, {points} points, {table}: " + ', '.join(
+                    f"type={row['type']} key={row['key']}" for row in plan
+                ))
+    return problems
+
+
+def main() -> int:
+    '''
+    Check the graph queries and report the problems
+    Returns:
+        (int): Exit status, 1 if a query does not use the expected index
+    '''
+    started = datetime.now()
+    try:
+        with util.DBConnection() as conn:
+            problems = check(conn.cursor())
+    except db.Error as err:
+        print(f"Database error: {err}", file=sys.stderr)
+        return 2
+    for problem in problems:
+        print(f"Error: {problem}", file=sys.stderr)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"Checked the graph queries in {elapsed:.1f} s: {len(problems)} problem(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
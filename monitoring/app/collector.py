@@ -1,125 +1,159 @@
 '''Data collector'''
-import asyncio
-import pathlib
 import os
-import re
 import sys
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 import mariadb as db
 
+import containers # pylint: disable=import-error
+import log_index # pylint: disable=import-error
+import retention # pylint: disable=import-error
+import rollup # pylint: disable=import-error
 import status # pylint: disable=import-error
-from util import get_eventloop, DBConnection # pylint: disable=import-error
+import sysmetrics # pylint: disable=import-error
+from access_log import AccessLogAnalyzer # pylint: disable=import-error
+from util import DBConnection # pylint: disable=import-error
 
 
 ACCESS_LOG_PATH = '/mnt/logs/apache/access.log'
+# Containers with CPU and memory columns in the data table
+LEGACY_CONTAINERS = [
+    'solr_solr', 'solr_cron', 'solr_zk', 'catalog_catalog', 'mariadb_galera'
+]
 
+_access_log = AccessLogAnalyzer(ACCESS_LOG_PATH)
+_disk_stats = sysmetrics.DiskStats()
 
-def init(debug: bool):
+
+def init():
     '''
-    Initialize the data collector
-    Args:
-        debug (bool): If true, do not start the scheduler
+    Initialize the data collector, with a scheduler running in background threads.
+    The app runs in a single process, so there is only one scheduler per node.
     '''
-    if not debug or os.getenv('WERKZEUG_RUN_MAIN') == 'true':
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(
-            func=main, id='collector', replace_existing=True, trigger='interval', minutes=1
-        )
-        scheduler.start()
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        func=main, id='collector', replace_existing=True, trigger='interval', minutes=1
+    )
+    scheduler.add_job(
+        func=rollup.main, id='rollup', replace_existing=True, trigger='interval', minutes=1
+    )
+    scheduler.add_job(
+        func=log_index.main, id='log_index', replace_existing=True, trigger='interval', minutes=1
+    )
+    scheduler.add_job(
+        func=retention.main, id='retention', replace_existing=True, trigger='interval', hours=1
+    )
+    scheduler.add_job(
+        func=status.probe_node_status, id='status', replace_existing=True,
+        trigger='interval', seconds=status.STATUS_PROBE_INTERVAL, next_run_time=datetime.now()
+    )
+    scheduler.start()
 
 def _analyse_log() -> dict[str, int | None]:
     # Get the number of requests from the apache log within the previous minute
     # and the average search response time in ms from the apache log within the previous minute
-    path = pathlib.Path(ACCESS_LOG_PATH)
-    if not path.is_file():
-        return {
-            'request_count': 0,
-            'response_time': None,
-        }
-    last_minute = datetime.now() - timedelta(minutes=1)
-    formatted_time = last_minute.strftime("%d/%b/%Y:%H:%M:\\d\\d %z")
-    request_count = 0
-    response_time_total = 0
-    response_time_count = 0
-    time_pattern = re.compile(formatted_time)
-    search_pattern = re.compile(r'GET /Search/Results.* (\d+)$')
+    _access_log.update()
+    return _access_log.minute_results(datetime.now() - timedelta(minutes=1))
+
+def _read_container_stats() -> dict[str, dict]:
     try:
-        with open(path, 'rb') as log_file:
-            # Seek log file in order to avoid parsing the whole file for line endings
-            # 10000 lines * 1024 max log entry length
-            if path.stat().st_size > 10240000:
-                log_file.seek(-10240000, os.SEEK_END)
-            while True:
-                line = log_file.readline().decode(encoding='utf-8', errors='ignore')
-                if not line:
-                    break
-                time_match = time_pattern.search(line)
-                if time_match:
-                    request_count += 1
-                    search_match = search_pattern.search(line, time_match.end())
-                    if search_match:
-                        time_nano = int(search_match.group(1))
-                        response_time_count += 1
-                        response_time_total += time_nano // 1000
-    except OSError as err:
-        print(f"Error reading the apache log file: {err}", file=sys.stderr)
-        return {
-            'request_count': 0,
-            'response_time': None,
-        }
-    return {
-        'request_count': request_count,
-        'response_time':
-            None if response_time_count == 0 else response_time_total // response_time_count,
-    }
+        return containers.update()
+    except (OSError, ValueError) as err:
+        print(f"Error reading the container metrics: {err}", file=sys.stderr)
+        return {}
 
-def _read_docker_stats():
+def _legacy_container_columns(container_stats: dict[str, dict]) -> dict[str, float | None]:
+    # CPU and memory percentages of the main containers, also kept in the data table
     variables = {}
-    stats_file = f'/mnt/shared/docker_stats/{os.getenv("NODE")}/{os.getenv("STACK_NAME")}'
-    with open(stats_file, 'r', encoding='UTF-8') as f:
-        while True:
-            line = f.readline()
-            if not line:
-                break
-            parts = line.split()
-            if len(parts) == 3:
-                variables[f'{parts[0]}_cpu'] = parts[1]
-                variables[f'{parts[0]}_mem'] = parts[2]
+    for name in LEGACY_CONTAINERS:
+        container = container_stats.get(name, {})
+        variables[f'{name}_cpu'] = container.get('cpu_percent')
+        variables[f'{name}_mem'] = container.get('memory_percent')
     return variables
 
-def main():
+def _read_system_metrics() -> dict[str, float | None]:
+    # Load average over 1 minute, percentage of time some tasks were stalled over
+    # the last minute, and disk rates in bytes/s since the previous run
+    metrics = {}
+    try:
+        metrics['load_average'] = sysmetrics.load_average()[0]
+    except (OSError, ValueError, IndexError) as err:
+        print(f"Error reading the load average: {err}", file=sys.stderr)
+        metrics['load_average'] = None
+    for resource in sysmetrics.PRESSURE_RESOURCES:
+        pressure = sysmetrics.pressure(resource)
+        metrics[f'{resource}_pressure'] = None if pressure is None else pressure.get('some_avg60')
+    try:
+        (metrics['disk_read_rate'], metrics['disk_write_rate']) = _disk_stats.update()
+    except (OSError, ValueError) as err:
+        print(f"Error reading the disk statistics: {err}", file=sys.stderr)
+        (metrics['disk_read_rate'], metrics['disk_write_rate']) = (None, None)
+    return metrics
+
+def main(): # pylint: disable=too-many-locals
     '''
     Get the node statistics and insert them into the database
     '''
     time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    results = get_eventloop().run_until_complete(asyncio.gather(
-        status.node_available_memory(),
-        status.node_available_disk_space()
-    ))
-    memory = results[0]
-    disk = results[1]
-    stats = _read_docker_stats()
+    memory = status.node_available_memory()
+    disk = status.node_available_disk_space()
+    system = _read_system_metrics()
+    container_stats = _read_container_stats()
+    stats = _legacy_container_columns(container_stats)
     log_results = _analyse_log()
     nb_requests = log_results['request_count']
     response_time = log_results['response_time']
+    node = os.getenv('NODE')
     conn = None
     try:
         with DBConnection() as conn:
             cur = conn.cursor()
             statement = "INSERT INTO data (node, time, available_memory, available_disk_space, " \
-                "apache_requests, response_time, solr_solr_cpu, solr_solr_mem, solr_cron_cpu, " \
-                "solr_cron_mem, solr_zk_cpu, solr_zk_mem, catalog_catalog_cpu, " \
-                "catalog_catalog_mem, mariadb_galera_cpu, mariadb_galera_mem) " \
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+                "apache_requests, response_time, response_time_p50, response_time_p90, " \
+                "response_time_p99, response_time_max, solr_solr_cpu, solr_solr_mem, " \
+                "solr_cron_cpu, solr_cron_mem, solr_zk_cpu, solr_zk_mem, catalog_catalog_cpu, " \
+                "catalog_catalog_mem, mariadb_galera_cpu, mariadb_galera_mem, load_average, " \
+                "cpu_pressure, memory_pressure, io_pressure, disk_read_rate, disk_write_rate) " \
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, " \
+                "%s, %s, %s, %s, %s, %s, %s, %s)"
             data = (
-                os.getenv('NODE'), time, memory, disk, nb_requests, response_time,
+                node, time, memory, disk, nb_requests, response_time,
+                log_results['response_time_p50'], log_results['response_time_p90'],
+                log_results['response_time_p99'], log_results['response_time_max'],
                 stats.get('solr_solr_cpu'), stats.get('solr_solr_mem'), stats.get('solr_cron_cpu'),
                 stats.get('solr_cron_mem'), stats.get('solr_zk_cpu'), stats.get('solr_zk_mem'),
                 stats.get('catalog_catalog_cpu'), stats.get('catalog_catalog_mem'),
-                stats.get('mariadb_galera_cpu'), stats.get('mariadb_galera_mem')
+                stats.get('mariadb_galera_cpu'), stats.get('mariadb_galera_mem'),
+                system['load_average'], system['cpu_pressure'], system['memory_pressure'],
+                system['io_pressure'], system['disk_read_rate'], system['disk_write_rate']
             )
             cur.execute(statement, data)
+            route_rows = [
+                (node, time, route, route_results['request_count'], route_results['bytes_sent'],
+                    route_results['response_time'], route_results['response_time_max'],
+                    route_results['histogram'])
+                for route, route_results in log_results['routes'].items()
+            ]
+            cur.executemany(
+                "INSERT INTO route_data (node, time, route, request_count, bytes_sent, " \
+                "response_time, response_time_max, histogram) " \
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                route_rows
+            )
+            container_rows = [
+                (node, time, name, container.get('cpu_percent'), container.get('memory_bytes'),
+                    container.get('memory_percent'), container.get('io_read_rate'),
+                    container.get('io_write_rate'), container.get('throttled_percent'),
+                    container['stale'])
+                for name, container in container_stats.items()
+            ]
+            if container_rows:
+                cur.executemany(
+                    "INSERT INTO container_data (node, time, container, cpu_percent, " \
+                    "memory_bytes, memory_percent, io_read_rate, io_write_rate, " \
+                    "throttled_percent, stale) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    container_rows
+                )
             conn.commit()
     except db.Error as err:
         print(f"Error adding entry to database: {err}", file=sys.stderr)
@@ -0,0 +1,213 @@
+'''Container metrics, read from the cgroup v2 files of the host'''
+import os
+import glob
+import re
+import time
+
+
+# Host /sys/fs/cgroup, mounted read-only
+CGROUP_ROOT = os.getenv('CGROUP_ROOT', '/mnt/host_cgroup')
+# Id and name of the containers of the stack on this node, one "<id> <name>" per line,
+# written by the container_names service: this container does not need the docker
+# socket or the configuration of the other containers
+CONTAINER_NAMES_FILE = os.getenv('CONTAINER_NAMES_FILE', '/mnt/container_names/names')
+# Container cgroups with the systemd and the cgroupfs drivers
+CGROUP_PATTERNS = ['system.slice/docker-*.scope', 'docker/*']
+CONTAINER_ID_PATTERN = re.compile(r'([0-9a-f]{64})')
+
+
+def _read_key_values(path: str) -> dict[str, int]:
+    values = {}
+    with open(path, 'r', encoding='UTF-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2 and parts[1].isdigit():
+                values[parts[0]] = int(parts[1])
+    return values
+
+def _read_int(path: str) -> int | None:
+    # None for 'max'
+    with open(path, 'r', encoding='UTF-8') as f:
+        value = f.read().strip()
+    return int(value) if value.isdigit() else None
+
+def _read_io(path: str) -> tuple[int, int]:
+    bytes_read = 0
+    bytes_written = 0
+    with open(path, 'r', encoding='UTF-8') as f:
+        for line in f:
+            for field in line.split()[1:]:
+                name, _, value = field.partition('=')
+                if name == 'rbytes':
+                    bytes_read += int(value)
+                elif name == 'wbytes':
+                    bytes_written += int(value)
+    return (bytes_read, bytes_written)
+
+def _host_memory() -> int:
+    with open('/proc/meminfo', 'r', encoding='UTF-8') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+    raise ValueError('MemTotal not found in /proc/meminfo')
+
+def _stack_container_name(name: str) -> str | None:
+    # Swarm task names look like {STACK_NAME}-catalog_catalog.1.<task id>;
+    # only the containers of this stack are kept, without the prefix and task
+    stack_prefix = f"{os.getenv('STACK_NAME')}-"
+    if not name.startswith(stack_prefix):
+        return None
+    return name[len(stack_prefix):].split('.')[0]
+
+def _read_container_names() -> dict[str, str]:
+    names = {}
+    with open(CONTAINER_NAMES_FILE, 'r', encoding='UTF-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 2 or not CONTAINER_ID_PATTERN.fullmatch(parts[0]):
+                continue
+            name = _stack_container_name(parts[1].lstrip('/'))
+            if name is not None:
+                names[parts[0]] = name
+    return names
+
+
+class ContainerStats(): # pylint: disable=too-few-public-methods
+    '''
+    Metrics for the containers of the stack running on this node. CPU, I/O and throttling
+    are computed from the differences between the cgroup counters of two updates, so a
+    container gets rates from its second update.
+    '''
+    def __init__(self):
+        self._names: dict[str, str] = {}
+        self._names_mtime = None
+        self._previous: dict[str, dict] = {}
+        self.latest: dict[str, dict] = {}
+        self.latest_time = None
+
+    def _cgroups(self) -> dict[str, str]:
+        cgroups = {}
+        for pattern in CGROUP_PATTERNS:
+            for path in glob.glob(f'{CGROUP_ROOT}/{pattern}'):
+                match = CONTAINER_ID_PATTERN.search(os.path.basename(path))
+                if match:
+                    cgroups[match.group(1)] = path
+        return cgroups
+
+    def _update_names(self):
+        # The names of the stopped containers are kept until their cgroup is gone
+        mtime = os.stat(CONTAINER_NAMES_FILE).st_mtime
+        if mtime != self._names_mtime:
+            self._names.update(_read_container_names())
+            self._names_mtime = mtime
+
+    @staticmethod
+    def _read_counters(path: str) -> dict:
+        cpu = _read_key_values(f'{path}/cpu.stat')
+        memory_stat = _read_key_values(f'{path}/memory.stat')
+        (io_read, io_written) = _read_io(f'{path}/io.stat')
+        return {
+            'time': time.monotonic(),
+            'cpu_usage': cpu.get('usage_usec', 0),
+            'nr_periods': cpu.get('nr_periods', 0),
+            'nr_throttled': cpu.get('nr_throttled', 0),
+            # Same memory usage as docker stats: without the inactive page cache
+            'memory': _read_int(f'{path}/memory.current') - memory_stat.get('inactive_file', 0),
+            'memory_limit': _read_int(f'{path}/memory.max'),
+            'io_read': io_read,
+            'io_written': io_written,
+        }
+
+    @staticmethod
+    def _rates(counters: dict, previous: dict | None, host_memory: int) -> dict:
+        limit = counters['memory_limit'] or host_memory
+        metrics = {
+            'memory_bytes': counters['memory'],
+            'memory_percent': counters['memory'] / limit * 100.,
+            'cpu_percent': None,
+            'io_read_rate': None,
+            'io_write_rate': None,
+            'throttled_percent': None,
+            'stale': True,
+        }
+        if previous is None or counters['time'] <= previous['time'] \
+                or counters['cpu_usage'] < previous['cpu_usage']:
+            # First update for the container, or restarted
+            return metrics
+        elapsed = counters['time'] - previous['time']
+        periods = counters['nr_periods'] - previous['nr_periods']
+        metrics.update({
+            'cpu_percent': (counters['cpu_usage'] - previous['cpu_usage']) / elapsed / 1e4,
+            'io_read_rate': (counters['io_read'] - previous['io_read']) / elapsed,
+            'io_write_rate': (counters['io_written'] - previous['io_written']) / elapsed,
+            'throttled_percent': 0. if periods <= 0 else
+                (counters['nr_throttled'] - previous['nr_throttled']) / periods * 100.,
+            'stale': False,
+        })
+        return metrics
+
+    def update(self) -> dict[str, dict]:
+        '''
+        Read the cgroup files of the containers of the stack
+        Returns:
+            (dict): Metrics for each container (by name without the stack prefix): CPU usage
+                and memory usage in percent (like docker stats), memory in bytes, I/O in
+                bytes/s, percentage of CPU periods throttled, and whether the data is stale
+                (no rates yet, or the container stopped since the previous update)
+        Raises:
+            OSError: If the cgroup files of the host or the container names are not available
+        '''
+        if not os.path.isdir(CGROUP_ROOT):
+            raise FileNotFoundError(f'{CGROUP_ROOT} is not mounted')
+        self._update_names()
+        host_memory = _host_memory()
+        previous = self._previous
+        self._previous = {}
+        results = {}
+        cgroups = self._cgroups()
+        for container_id, path in cgroups.items():
+            name = self._names.get(container_id)
+            if name is None:
+                continue
+            try:
+                counters = self._read_counters(path)
+            except (OSError, ValueError, TypeError):
+                # The container stopped while being read
+                continue
+            self._previous[container_id] = counters
+            results[name] = self._rates(counters, previous.get(container_id), host_memory)
+        # Containers which disappeared since the previous update
+        for container_id in previous:
+            if container_id not in self._previous:
+                name = self._names.get(container_id)
+                if name is not None and name not in results:
+                    results[name] = {'stale': True}
+        self._names = {
+            container_id: name for container_id, name in self._names.items()
+            if container_id in cgroups
+        }
+        self.latest = results
+        self.latest_time = time.strftime('%Y-%m-%d %H:%M:%S')
+        return results
+
+
+_container_stats = ContainerStats()
+
+
+def update() -> dict[str, dict]:
+    '''
+    Read the metrics of the containers of the stack, called every minute by the collector
+    Returns:
+        (dict): See ContainerStats.update
+    Raises:
+        OSError: If the cgroup files of the host or the container names are not available
+    '''
+    return _container_stats.update()
+
+def last_report() -> dict:
+    '''
+    Get the metrics from the last update
+    Returns:
+        (dict): Time of the update, and metrics for each container
+    '''
+    return {'time': _container_stats.latest_time, 'containers': _container_stats.latest}
@@ -0,0 +1,82 @@
+'''Galera status, read with a native asynchronous client'''
+import os
+import asyncio
+import aiomysql
+
+from util import DEFAULT_TIMEOUT # pylint: disable=import-error
+
+
+# Status variables read for each node, with their type
+GALERA_VARIABLES = {
+    'wsrep_cluster_size': int,
+    'wsrep_cluster_state_uuid': str,
+    'wsrep_cluster_status': str,
+    'wsrep_local_state_comment': str,
+    'wsrep_ready': str,
+    'wsrep_local_recv_queue': int,
+    'wsrep_local_recv_queue_avg': float,
+    'wsrep_local_send_queue': int,
+    'wsrep_flow_control_paused': float,
+    'wsrep_flow_control_paused_ns': int,
+    'wsrep_flow_control_sent': int,
+    'wsrep_flow_control_recv': int,
+}
+
+
+# Pool created on the background event loop (see util.run_async), where the probes run
+_pool = None # pylint: disable=invalid-name
+
+
+def _read_password() -> str:
+    with open(os.getenv('MARIADB_VUFIND_PASSWORD_FILE'), 'r', encoding='UTF-8') as f:
+        return f.read().strip()
+
+async def _get_pool(timeout: int) -> aiomysql.Pool:
+    global _pool # pylint: disable=global-statement
+    if _pool is None:
+        _pool = await aiomysql.create_pool(
+            host='galera', user='vufind', password=_read_password(), connect_timeout=timeout,
+            minsize=0, maxsize=2, pool_recycle=600
+        )
+    return _pool
+
+def _convert(name: str, value: str) -> str | int | float | None:
+    try:
+        return GALERA_VARIABLES[name](value)
+    except ValueError:
+        return None
+
+async def node_galera_status(timeout: int=DEFAULT_TIMEOUT) -> dict | str:
+    '''
+    Read the Galera status variables of this node, with a single query.
+    Must run on the background event loop (see util.run_async).
+    Args:
+        timeout (int): Timeout for the connection and the query
+    Returns:
+        (dict|str): Value for each of GALERA_VARIABLES (None if missing), or error message
+    '''
+    async def query():
+        pool = await _get_pool(timeout)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                names = list(GALERA_VARIABLES)
+                placeholders = ', '.join(['%s'] * len(names))
+                await cur.execute(
+                    'SELECT LOWER(variable_name), variable_value ' \
+                    'FROM information_schema.global_status ' \
+                    f'WHERE variable_name IN ({placeholders})',
+                    names
+                )
+                return await cur.fetchall()
+
+    try:
+        rows = await asyncio.wait_for(query(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return 'Timeout when reading the galera status'
+    except (aiomysql.Error, OSError) as err:
+        return f'Error reading the galera status: {err}'
+    status = dict.fromkeys(GALERA_VARIABLES)
+    for name, value in rows:
+        if name in GALERA_VARIABLES:
+            status[name] = _convert(name, value)
+    return status
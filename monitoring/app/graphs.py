@@ -3,22 +3,67 @@ from datetime import datetime, timedelta
 import os
 import asyncio
 import json
-import flask
+import urllib.parse
+import quart
 import mariadb as db
 import aiohttp
 
+import retention # pylint: disable=import-error
 import util # pylint: disable=import-error
+from access_log import ROUTE_CLASSES # pylint: disable=import-error
+from histogram import Histogram # pylint: disable=import-error
 
 
 KNOWN_VARIABLES = [
     'available_memory', 'available_disk_space', 'apache_requests', 'response_time',
-    'solr_solr_cpu', 'solr_solr_mem', 'solr_cron_cpu', 'solr_cron_mem', 'solr_zk_cpu',
-    'solr_zk_mem', 'catalog_catalog_cpu', 'catalog_catalog_mem', 'mariadb_galera_cpu',
-    'mariadb_galera_mem'
+    'response_time_p50', 'response_time_p90', 'response_time_p99', 'response_time_max',
+    'route_requests', 'route_bytes_sent', 'route_response_time', 'solr_solr_cpu',
+    'solr_solr_mem', 'solr_cron_cpu', 'solr_cron_mem', 'solr_zk_cpu', 'solr_zk_mem',
+    'catalog_catalog_cpu', 'catalog_catalog_mem', 'mariadb_galera_cpu', 'mariadb_galera_mem',
+    'load_average', 'cpu_pressure', 'memory_pressure', 'io_pressure', 'disk_read_rate',
+    'disk_write_rate'
 ]
+# Variables averaged over time buckets (the others use the maximum for memory usage
+# and the minimum for available resources)
+AVERAGED_VARIABLES = [
+    'apache_requests', 'response_time', 'load_average', 'cpu_pressure', 'memory_pressure',
+    'io_pressure', 'disk_read_rate', 'disk_write_rate'
+]
+# Variables computed by merging the response time histograms of a route class,
+# with the matching percentile (None for the maximum)
+HISTOGRAM_VARIABLES = {
+    'response_time_p50': 50,
+    'response_time_p90': 90,
+    'response_time_p99': 99,
+    'response_time_max': None,
+}
+# Variables read from the route_data tables for a family of routes
+ROUTE_VARIABLES = ['route_requests', 'route_bytes_sent', 'route_response_time']
+NODES = [1, 2, 3]
+PERIODS = ['hour', 'day', 'week', 'month', 'year', 'decade', 'custom']
+DEFAULT_POINTS = 100
+MAX_POINTS = 2000
+# Possible widths of the time buckets, in seconds. Monthly rollup rows are always
+# at least 28 days apart, so with 28 days or more each of them ends up in its own bucket.
+BUCKET_WIDTHS = [
+    60, 2*60, 5*60, 10*60, 15*60, 30*60,
+    60*60, 2*60*60, 3*60*60, 6*60*60, 12*60*60,
+    24*60*60, 2*24*60*60, 7*24*60*60, 28*24*60*60, 91*24*60*60, 365*24*60*60,
+]
+# Rollup tables with the width of their rows, from the coarsest to the finest
+ROLLUP_WIDTHS = [
+    ('monthly', 28*24*60*60),
+    ('daily', 24*60*60),
+    ('hourly', 60*60),
+]
+# Time buckets computed without any function on the time in the WHERE clause, so that
+# the (node, time) indexes are used for the range. They are counted from a Monday at
+# midnight in local time (the times are saved in local time, like the rollups), so that
+# the day buckets start at midnight and the week buckets on Monday.
+SQL_BUCKET = "FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-05', time) / %s)"
 
 
-def _times_by_period(period: str) -> list[datetime]:
+def _times_by_period(period: str) -> tuple[datetime, datetime]:
     delta_by_period = {
         'hour': timedelta(hours=1),
         'day': timedelta(days=1),
@@ -32,124 +77,423 @@ def _times_by_period(period: str) -> list[datetime]:
     period_end = datetime.now()
     return (period_start, period_end)
 
-def _group_by_times(period_start: datetime, period_end: datetime) -> str:
-    delta = period_end - period_start
-    interval = round(delta.total_seconds() / 100.)
-    if interval > 60*60*24*30:
-        group = 'MONTH'
-    elif interval > 60*60*24:
-        group = 'DAY'
-    elif interval > 60*60:
-        group = 'HOUR'
-    else:
-        group = 'MINUTE'
-    return group
-
-def _sql_query(variable: str, period_start: datetime, period_end: datetime, group: str) -> str:
-    sql_start = period_start.strftime('%Y-%m-%d %H:%M:%S')
-    sql_end = period_end.strftime('%Y-%m-%d %H:%M:%S')
-    sql_select_by_group = {
-        'MONTH': 'YEAR(time) AS Year, MONTH(time) AS Month',
-        'DAY': 'YEAR(time) AS Year, MONTH(time) AS Month, DAY(time) AS Day',
-        'HOUR': 'YEAR(time) AS Year, MONTH(time) AS Month, DAY(time) AS Day, HOUR(time) AS Hour',
-        'MINUTE': 'YEAR(time) AS Year, MONTH(time) AS Month, DAY(time) AS Day, ' \
-            'HOUR(time) AS Hour, MINUTE(time) AS Minute',
-    }
-    sql_select = sql_select_by_group[group]
-    sql_group_by_group = {
-        'MONTH': 'YEAR(time), MONTH(time)',
-        'DAY': 'YEAR(time), MONTH(time), DAY(time)',
-        'HOUR': 'YEAR(time), MONTH(time), DAY(time), HOUR(time)',
-        'MINUTE': 'YEAR(time), MONTH(time), DAY(time), HOUR(time), MINUTE(time)',
-    }
-    sql_group = sql_group_by_group[group]
-    node = os.getenv('NODE')
-    if variable in ['apache_requests', 'response_time'] or variable.endswith('_cpu'):
-        aggreg = 'AVG'
-    elif variable.endswith('_mem'):
-        aggreg = 'MAX'
+def _local_time(value: str) -> datetime:
+    # Naive local time, like the times in the database; raises ValueError if invalid
+    # (fromisoformat only accepts Z from Python 3.11)
+    time = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    if time.tzinfo is not None:
+        time = time.astimezone().replace(tzinfo=None)
+    return time
+
+def graph_window(period: str, # pylint: disable=too-many-return-statements
+        window: dict | None = None) -> tuple[datetime, datetime, int] | str:
+    '''
+    Get the time window and number of points for a graph
+    Args:
+        period (str): One of PERIODS, 'custom' to use the start and end of window
+        window (dict): Optional start of the custom period (in ISO format), end of the
+            custom period (in ISO format, default: now) and target number of points
+            (default: DEFAULT_POINTS), as strings, like the request parameters
+    Returns:
+        (tuple|str): Start, end and number of points, or error message
+    '''
+    if period not in PERIODS:
+        return 'Error: unknown period'
+    window = window or {}
+    (start, end, points) = (window.get('start'), window.get('end'), window.get('points'))
+    if period == 'custom':
+        if not start:
+            return 'Error: missing start'
+        try:
+            period_start = _local_time(start)
+            period_end = _local_time(end) if end else datetime.now()
+        except ValueError:
+            return 'Error: invalid start or end'
+        if period_end <= period_start:
+            return 'Error: end is not after start'
     else:
-        aggreg = 'MIN'
-    return f'SELECT {sql_select}, {aggreg}({variable}) AS {variable} FROM data ' \
-        f'WHERE time > "{sql_start}" AND time < "{sql_end}" AND node = {node} GROUP BY {sql_group};'
+        (period_start, period_end) = _times_by_period(period)
+    if not points:
+        return (period_start, period_end, DEFAULT_POINTS)
+    if not points.isdigit() or not 0 < int(points) <= MAX_POINTS:
+        return f'Error: points should be between 1 and {MAX_POINTS}'
+    return (period_start, period_end, int(points))
+
+def _bucket_width(period_start: datetime, period_end: datetime, points: int) -> int:
+    # Largest width giving at least the requested number of points
+    target = (period_end - period_start).total_seconds() / points
+    width = BUCKET_WIDTHS[0]
+    for candidate in BUCKET_WIDTHS:
+        if candidate <= target:
+            width = candidate
+    return width
+
+def _rollup_for_width(width: int) -> str | None:
+    # Coarsest table which still has at least one row per bucket
+    for rollup, rollup_width in ROLLUP_WIDTHS:
+        if rollup_width <= width:
+            return rollup
+    return None
+
+def _rollup_for_window(width: int, period_start: datetime) -> str | None:
+    # Table for the width, or a coarser one when the rows at the start of the window
+    # have already been deleted by the retention policy (the monthly one at worst)
+    tables = [None] + [rollup for rollup, _ in reversed(ROLLUP_WIDTHS)]
+    now = datetime.now()
+    for rollup in tables[tables.index(_rollup_for_width(width)):]:
+        days = retention.RETENTION_DAYS['raw' if rollup is None else rollup]
+        if days is None or period_start >= now - timedelta(days=days):
+            return rollup
+    return tables[-1]
+
+def _time_format(width: int) -> str:
+    if width >= 28*24*60*60:
+        return '%Y-%m'
+    if width >= 24*60*60:
+        return '%Y-%m-%d'
+    return '%Y-%m-%d %H:%M'
+
+def _period_label(period: str, window: dict) -> str:
+    if period != 'custom':
+        return f'for the last {period}'
+    start = window['start'].replace('T', ' ')
+    if not window.get('end'):
+        return f'since {start}'
+    return f"from {start} to {window['end'].replace('T', ' ')}"
+
+def _aggregation(variable: str) -> str:
+    if variable in AVERAGED_VARIABLES or variable.endswith('_cpu'):
+        return 'AVG'
+    if variable.endswith('_mem'):
+        return 'MAX'
+    return 'MIN'
 
-def node_graph_data(variable: str, period: str) -> dict[str, list] | str:
+def _histogram_value(histogram: Histogram, variable: str) -> int | None:
+    # Histograms are in microseconds, graphs in ms
+    percent = HISTOGRAM_VARIABLES[variable]
+    value = histogram.max if percent is None else histogram.percentile(percent)
+    return None if value is None else value // 1000
+
+def _route_value(stats: dict, variable: str) -> float | None:
+    if variable in HISTOGRAM_VARIABLES:
+        return _histogram_value(stats['histogram'], variable)
+    if variable == 'route_requests':
+        return stats['request_count'] / stats['sample_count']
+    if variable == 'route_bytes_sent':
+        return stats['bytes_sent'] / stats['sample_count']
+    if stats['request_count'] == 0:
+        return None
+    return stats['response_time_total'] / stats['request_count']
+
+def _json_number(value) -> float | int | None:
+    # Averages are returned as decimals by the database
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return float(value)
+
+def _add_time(times: dict[int, datetime], bucket: int, time: datetime):
+    # Buckets are labelled with the time of their first row, for all the series
+    if bucket not in times or time < times[bucket]:
+        times[bucket] = time
+
+def _read_data_series(cur, variables: list[str], selection: dict, values: dict, times: dict): # pylint: disable=too-many-locals
+    # selection: nodes, start and end of the window, and width of the buckets
+    rollup = _rollup_for_window(selection['width'], selection['start'])
+    node_list = ', '.join(['%s'] * len(selection['nodes']))
+    where = f'WHERE node IN ({node_list}) AND time >= %s AND time < %s'
+    params = [selection['width']] + selection['nodes'] + [selection['start'], selection['end']]
+    if rollup is None:
+        # One column per variable
+        aggregations = ', '.join(f'{_aggregation(variable)}({variable})' for variable in variables)
+        cur.execute(
+            f'SELECT node, {SQL_BUCKET} AS bucket, MIN(time), {aggregations} FROM data ' \
+            f'{where} GROUP BY node, bucket',
+            params
+        )
+        for (node, bucket, time, *row) in cur:
+            _add_time(times, bucket, time)
+            for variable, value in zip(variables, row):
+                values[(node, variable)][bucket] = value
+        return
+    # One row per variable, with all the aggregations
+    variable_list = ', '.join(['%s'] * len(variables))
+    cur.execute(
+        f'SELECT node, {SQL_BUCKET} AS bucket, MIN(time), variable, MIN(min_value), ' \
+        'MAX(max_value), SUM(avg_value * sample_count) / SUM(sample_count) ' \
+        f'FROM data_{rollup} {where} AND variable IN ({variable_list}) ' \
+        'GROUP BY node, variable, bucket',
+        params + variables
+    )
+    for (node, bucket, time, variable, min_value, max_value, avg_value) in cur:
+        _add_time(times, bucket, time)
+        values[(node, variable)][bucket] = \
+            {'MIN': min_value, 'MAX': max_value, 'AVG': avg_value}[_aggregation(variable)]
+
+def _read_route_series(cur, variables: list[str], selection: dict, values: dict, times: dict): # pylint: disable=too-many-locals
+    # selection: nodes, start and end of the window, width of the buckets, and family
+    # of routes. Histograms are merged here, so the route rows are grouped in Python
+    rollup = _rollup_for_window(selection['width'], selection['start'])
+    table = 'route_data' if rollup is None else f'route_data_{rollup}'
+    samples = '1' if rollup is None else 'sample_count'
+    node_list = ', '.join(['%s'] * len(selection['nodes']))
+    cur.execute(
+        f'SELECT node, {SQL_BUCKET} AS bucket, time, request_count, bytes_sent, response_time, ' \
+        f'response_time_max, histogram, {samples} FROM {table} WHERE node IN ({node_list}) ' \
+        'AND time >= %s AND time < %s AND route = %s',
+        [selection['width']] + selection['nodes'] +
+            [selection['start'], selection['end'], selection['route']]
+    )
+    with_histograms = any(variable in HISTOGRAM_VARIABLES for variable in variables)
+    buckets = {}
+    for (node, bucket, time, count, bytes_sent, response_time, time_max, histogram, samples) in cur:
+        _add_time(times, bucket, time)
+        if (node, bucket) not in buckets:
+            buckets[(node, bucket)] = {
+                'request_count': 0, 'bytes_sent': 0, 'response_time_total': 0,
+                'histogram': Histogram(), 'sample_count': 0,
+            }
+        stats = buckets[(node, bucket)]
+        stats['request_count'] += count
+        stats['bytes_sent'] += bytes_sent
+        if response_time is not None:
+            stats['response_time_total'] += response_time * count
+        if with_histograms:
+            stats['histogram'].merge(Histogram.decode(histogram, time_max))
+        stats['sample_count'] += samples
+    for (node, bucket), stats in buckets.items():
+        for variable in variables:
+            values[(node, variable)][bucket] = _route_value(stats, variable)
+
+def series_data(variables: list[str], nodes: list[int], period: str, route: str = 'search', # pylint: disable=too-many-locals,too-many-return-statements
+        window: dict | None = None) -> dict[str, list] | str:
     '''
-    Get the graph data for the nodes
+    Get the graph data for several variables and nodes, with the same time buckets.
+    The data variables are read with one query, and the route variables with another one.
     Args:
-        variable (str): Type of graph data
-        period (str): Period of time to limit for
+        variables (list[str]): Variables, from KNOWN_VARIABLES
+        nodes (list[int]): Nodes, from NODES
+        period (str): Period of time to limit for, 'custom' to use the start and end of window
+        route (str): Family of routes, for the route and response time percentile variables
+        window (dict): Custom period and number of points, see graph_window; the width of
+            the time buckets adapts to the number of points
     Returns:
-        (dict|str): Graph data or error message
+        (dict|str): Labels of the time buckets, and the values of each series for these
+            buckets (None when there is no data), or error message
     '''
-    if variable not in KNOWN_VARIABLES:
+    if not variables or any(variable not in KNOWN_VARIABLES for variable in variables):
         return 'Error: unknown variable'
-    if period not in ['hour', 'day', 'week', 'month', 'year', 'decade']:
-        return 'Error: unknown period'
-    # someday this will support any given date/time for start and end
-    (period_start, period_end) = _times_by_period(period)
-    group = _group_by_times(period_start, period_end)
-    conn = None
+    if not nodes or any(node not in NODES for node in nodes):
+        return 'Error: unknown node'
+    if route not in ROUTE_CLASSES:
+        return 'Error: unknown route'
+    window = graph_window(period, window)
+    if isinstance(window, str):
+        return window
+    (period_start, period_end, points) = window
+    width = _bucket_width(period_start, period_end, points)
+    selection = {
+        'nodes': nodes, 'start': period_start, 'end': period_end, 'width': width, 'route': route
+    }
+    values = {(node, variable): {} for node in nodes for variable in variables}
+    times = {}
+    route_variables = [
+        variable for variable in variables
+        if variable in HISTOGRAM_VARIABLES or variable in ROUTE_VARIABLES
+    ]
+    data_variables = [variable for variable in variables if variable not in route_variables]
     try:
         with util.DBConnection() as conn:
             cur = conn.cursor()
-            cur.execute(_sql_query(variable, period_start, period_end, group))
-            pt_x = []
-            pt_y = []
-            for row in cur:
-                if group == 'MONTH':
-                    x = datetime(row[0], row[1], 1).strftime('%Y-%m')
-                elif group == 'DAY':
-                    x = datetime(row[0], row[1], row[2]).strftime('%Y-%m-%d')
-                elif group == 'HOUR':
-                    x = datetime(row[0], row[1], row[2], row[3]).strftime('%Y-%m-%d %H')
-                else:
-                    x = datetime(
-                        row[0], row[1], row[2], row[3], row[4]
-                        ).strftime('%Y-%m-%d %H:%M:%S')
-                if row[-1] is not None:
-                    pt_x.append(x)
-                    pt_y.append(row[-1])
+            if data_variables:
+                _read_data_series(cur, data_variables, selection, values, times)
+            if route_variables:
+                _read_route_series(cur, route_variables, selection, values, times)
     except db.Error as err:
         return f"Database error: {err}"
+    buckets = sorted(times)
+    time_format = _time_format(width)
+    return {
+        'timestamps': [times[bucket].strftime(time_format) for bucket in buckets],
+        'series': [
+            {
+                'node': node,
+                'variable': variable,
+                'values': [_json_number(series.get(bucket)) for bucket in buckets],
+            }
+            for (node, variable), series in values.items()
+        ],
+    }
+
+def node_graph_data(variable: str, period: str, route: str = 'search',
+        window: dict | None = None) -> dict[str, list] | str:
+    '''
+    Get the graph data for the nodes
+    Args:
+        variable (str): Type of graph data
+        period (str): Period of time to limit for, 'custom' to use the start and end of window
+        route (str): Family of routes, for the route and response time percentile variables
+        window (dict): Custom period and number of points, see graph_window; the width of
+            the time buckets adapts to the number of points
+    Returns:
+        (dict|str): Graph data or error message
+    '''
+    data = series_data([variable], [int(os.getenv('NODE'))], period, route, window)
+    if isinstance(data, str):
+        return data
+    pt_x = []
+    pt_y = []
+    for time, value in zip(data['timestamps'], data['series'][0]['values']):
+        if value is not None:
+            pt_x.append(time)
+            pt_y.append(value)
     return {
         'pt_x': pt_x,
         'pt_y': pt_y,
     }
 
-def graph(variable: str, period: str) -> str:
+def graph_data(period: str, variables: str | None, nodes: str | None = None,
+        route: str = 'search', window: dict | None = None) -> dict[str, list] | str:
     '''
-    Get and render the graph for the given period
+    Get the graph data for several variables, see series_data
     Args:
-        variable (str): Type of graph to get
-        period (str): Period of time to get the graph data for
+        period (str): Period of time to limit for, 'custom' to use the start and end of window
+        variables (str): Comma-separated list of variables
+        nodes (str): Comma-separated list of nodes, or 'all' (default: this node)
+        route (str): Family of routes, for the route and response time percentile variables
+        window (dict): Custom period and number of points, see graph_window
+    Returns:
+        (dict|str): Graph data or error message
     '''
-    if variable not in KNOWN_VARIABLES:
-        return 'Error: unknown variable'
-    if period not in ['hour', 'day', 'week', 'month', 'year', 'decade']:
-        return 'Error: unknown period'
-    urls = []
-    for node in range(1, 4):
-        urls.append(f'http://monitoring{node}/monitoring/node/graph_data/{variable}/{period}')
+    if not variables:
+        return 'Error: missing variables'
+    if nodes is None:
+        node_list = [int(os.getenv('NODE'))]
+    elif nodes == 'all':
+        node_list = NODES
+    else:
+        try:
+            node_list = [int(node) for node in nodes.split(',')]
+        except ValueError:
+            return 'Error: unknown node'
+    return series_data(variables.split(','), node_list, period, route, window)
+
+async def dashboard(period: str, route: str = 'search', window: dict | None = None) -> str:
+    '''
+    Render the graphs for all the variables and nodes
+    Args:
+        period (str): Period of time to get the graph data for, 'custom' to use the start
+            and end of window
+        route (str): Family of routes, for the route and response time percentile variables
+        window (dict): Custom period and number of points, see graph_window
+    '''
+    data = await asyncio.to_thread(series_data, KNOWN_VARIABLES, NODES, period, route, window)
+    if isinstance(data, str):
+        return data
+    window = window or {}
+    params = {'route': route}
+    if period == 'custom':
+        params['start'] = window['start']
+        if window.get('end'):
+            params['end'] = window['end']
+    if window.get('points'):
+        params['points'] = window['points']
+    return await quart.render_template(
+        'dashboard.html',
+        period=period, data=data, stack_name=os.getenv('STACK_NAME'), route=route,
+        routes=ROUTE_CLASSES, params=params, period_label=_period_label(period, params)
+    )
+
+async def _fan_out_graph_data(variable: str, period: str, query: str, nodes: list[int]) -> tuple[dict[int, tuple[list, list]], str | None]: # pylint: disable=line-too-long
+    # Get the graph data from the nodes themselves
+    urls = [
+        f'http://monitoring{node}/monitoring/node/graph_data/{variable}/{period}?{query}'
+        for node in nodes
+    ]
     try:
-        nodes_graph_data = util.multiple_get(urls)
+        nodes_graph_data = await util.async_multiple_get(urls)
     except aiohttp.ClientError as err:
-        return f'Error getting graph data: {err}'
+        return ({}, f'Error getting graph data: {err}')
     except asyncio.exceptions.TimeoutError:
-        return 'Timeout getting graph data'
-    data = []
-    for node in range(1, 4):
+        return ({}, 'Timeout getting graph data')
+    points_by_node = {}
+    for node, node_graph_data_text in zip(nodes, nodes_graph_data):
         try:
-            j = json.loads(nodes_graph_data[node-1])
+            j = json.loads(node_graph_data_text)
         except json.JSONDecodeError as err:
-            return f'Error decoding JSON from node {node}: {err}'
+            return (points_by_node, f'Error decoding JSON from node {node}: {err}')
+        points_by_node[node] = (j['pt_x'], j['pt_y'])
+    return (points_by_node, None)
+
+async def graph(variable: str, period: str, route: str = 'search', # pylint: disable=too-many-locals
+        window: dict | None = None) -> str:
+    '''
+    Get and render the graph for the given period
+    Args:
+        variable (str): Type of graph to get
+        period (str): Period of time to get the graph data for, 'custom' to use the start
+            and end of window
+        route (str): Family of routes, for the route and response time percentile variables
+        window (dict): Custom period and number of points, see graph_window
+    '''
+    if variable not in KNOWN_VARIABLES:
+        return 'Error: unknown variable'
+    if route not in ROUTE_CLASSES:
+        return 'Error: unknown route'
+    window = graph_window(period, window)
+    if isinstance(window, str):
+        return window
+    (period_start, period_end, points) = window
+    # The same window is requested from all the nodes
+    params = {'route': route, 'points': str(points)}
+    if period == 'custom':
+        params['start'] = period_start.isoformat(timespec='seconds')
+        params['end'] = period_end.isoformat(timespec='seconds')
+    # All the nodes write to the same Galera database, so the data of all the nodes is read
+    # locally; the other nodes are only asked for their own data when it is missing locally
+    # (the local query failed, or returned nothing for them, for instance when the
+    # replication lags)
+    points_by_node = {}
+    local_data = await asyncio.to_thread(series_data, [variable], NODES, period, route, params)
+    error = None
+    if isinstance(local_data, str):
+        error = local_data
+    else:
+        for series in local_data['series']:
+            pt_x = []
+            pt_y = []
+            for time, value in zip(local_data['timestamps'], series['values']):
+                if value is not None:
+                    pt_x.append(time)
+                    pt_y.append(value)
+            points_by_node[series['node']] = (pt_x, pt_y)
+    missing_nodes = [
+        node for node in NODES
+        if node != int(os.getenv('NODE')) and not points_by_node.get(node, ([], []))[0]
+    ]
+    if missing_nodes:
+        (remote_points, fan_out_error) = await _fan_out_graph_data(
+            variable, period, urllib.parse.urlencode(params), missing_nodes
+        )
+        points_by_node.update(
+            (node, points) for node, points in remote_points.items() if points[0]
+        )
+        if fan_out_error is not None:
+            error = fan_out_error if error is None else f'{error}; {fan_out_error}'
+    data = []
+    for node in NODES:
+        (pt_x, pt_y) = points_by_node.get(node, ([], []))
         node_data = {}
         node_data['name'] = f'node {node}'
         node_data['type'] = 'scatter'
-        node_data['x'] = j['pt_x']
-        node_data['y'] = j['pt_y']
+        node_data['x'] = pt_x
+        node_data['y'] = pt_y
         data.append(node_data)
-    return flask.render_template(
+    return await quart.render_template(
         'graph.html',
-        variable=variable, period=period, data=data, stack_name=os.getenv('STACK_NAME')
+        variable=variable, period=period, data=data, stack_name=os.getenv('STACK_NAME'),
+        route=route if variable in HISTOGRAM_VARIABLES or variable in ROUTE_VARIABLES else None,
+        routes=ROUTE_CLASSES, params=params,
+        period_label=_period_label(period, params),
+        error=error, start=period_start.isoformat(timespec='minutes'),
+        end=period_end.isoformat(timespec='minutes')
     )
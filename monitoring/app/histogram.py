@@ -0,0 +1,125 @@
+'''Response time histograms'''
+import math
+
+
+# Number of bits used for sub-buckets within each power of 2: 16 sub-buckets,
+# so recorded values are precise to about 6% (HDR-style log-linear buckets)
+SUB_BUCKET_BITS = 4
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+# Values are recorded in microseconds, the largest tracked value is about 35 minutes
+MAX_EXPONENT = 31
+BUCKET_COUNT = SUB_BUCKET_COUNT + (MAX_EXPONENT - SUB_BUCKET_BITS + 1) * SUB_BUCKET_COUNT
+
+
+def bucket_index(value: int) -> int:
+    '''
+    Get the index of the bucket for a value
+    Args:
+        value (int): Value to record
+    Returns:
+        (int): Index of the bucket
+    '''
+    if value < SUB_BUCKET_COUNT:
+        return max(value, 0)
+    exponent = value.bit_length() - 1
+    if exponent > MAX_EXPONENT:
+        return BUCKET_COUNT - 1
+    sub_bucket = (value >> (exponent - SUB_BUCKET_BITS)) - SUB_BUCKET_COUNT
+    return SUB_BUCKET_COUNT + (exponent - SUB_BUCKET_BITS) * SUB_BUCKET_COUNT + sub_bucket
+
+def bucket_upper_bound(index: int) -> int:
+    '''
+    Get the highest value recorded in a bucket
+    Args:
+        index (int): Index of the bucket
+    Returns:
+        (int): Highest value for the bucket
+    '''
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift, sub_bucket = divmod(index - SUB_BUCKET_COUNT, SUB_BUCKET_COUNT)
+    return ((SUB_BUCKET_COUNT + sub_bucket + 1) << shift) - 1
+
+
+class Histogram():
+    '''
+    Fixed-bucket histogram of values, which can be merged with other histograms
+    and encoded in a compact string for the database
+    '''
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.max = None
+
+    def record(self, value: int):
+        '''
+        Record a value
+        Args:
+            value (int): Value to record
+        '''
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        '''
+        Add the values from another histogram
+        Args:
+            other (Histogram): Histogram to merge into this one
+        '''
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percent: float) -> int | None:
+        '''
+        Get the value at a given percentile
+        Args:
+            percent (float): Percentile, between 0 and 100
+        Returns:
+            (int|None): Highest value of the bucket containing the percentile,
+                or None if the histogram is empty
+        '''
+        if self.total == 0:
+            return None
+        rank = max(1, math.ceil(percent / 100. * self.total))
+        cumulative = 0
+        for index in sorted(self.counts):
+            cumulative += self.counts[index]
+            if cumulative >= rank:
+                return min(bucket_upper_bound(index), self.max)
+        return self.max
+
+    def encode(self) -> str:
+        '''
+        Encode the histogram for the database
+        Returns:
+            (str): Sparse list of bucket:count pairs
+        '''
+        return ','.join(f'{index}:{self.counts[index]}' for index in sorted(self.counts))
+
+    @classmethod
+    def decode(cls, text: str | None, max_value: int | None = None) -> 'Histogram':
+        '''
+        Create a histogram from its database encoding
+        Args:
+            text (str): Sparse list of bucket:count pairs
+            max_value (int): Exact maximum value, if known
+        Returns:
+            (Histogram): The histogram
+        '''
+        histogram = cls()
+        if text:
+            for pair in text.split(','):
+                index, count = pair.split(':')
+                histogram.counts[int(index)] = int(count)
+                histogram.total += int(count)
+        if max_value is not None:
+            histogram.max = max_value
+        elif histogram.counts:
+            histogram.max = bucket_upper_bound(max(histogram.counts))
+        return histogram
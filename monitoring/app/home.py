@@ -1,18 +1,18 @@
 '''Home Page'''
 import os
 import asyncio
-import flask
+import quart
 
 import status # pylint: disable=import-error
 
-def homepage() -> str:
+async def homepage() -> str:
     '''
     Gets the contents for the home page and renders the template
     '''
     stack_name = os.getenv('STACK_NAME', '')
     is_prod = stack_name.endswith('-prod')
     is_dev = stack_name.startswith('devel-') or stack_name.startswith('review-')
-    statuses = status.get_node_statuses()
+    (statuses, statuses_age) = await asyncio.to_thread(status.get_node_statuses)
 
     if isinstance(statuses, str):
         return statuses
@@ -20,7 +20,7 @@ def homepage() -> str:
     status_list = {}
     status_list['memory'] = status.get_memory_status(statuses)
     status_list['disk_space'] = status.get_disk_space_status(statuses)
-    status_list['galera'] = asyncio.run(status.get_galera_status(statuses))
+    status_list['galera'] = status.get_galera_status(statuses)
     status_list['solr'] = status.get_solr_status(statuses)
     status_list['vufind'] = status.get_vufind_status(statuses)
     status_list['folio_harvest'] = status.get_cron_status('folio', statuses)
@@ -40,15 +40,24 @@ def homepage() -> str:
     for s_name, s_text in status_list.items():
         if s_text.startswith('OK'):
             color = 'success'
+        elif s_text.startswith('Warning'):
+            color = 'warning'
         else:
             color = 'danger'
         services[s_name] = {
             'color': color,
             'status': s_text,
         }
-    return flask.render_template(
+    return await quart.render_template(
         'index.html',
         services=services,
+        galera_details=status.get_galera_details(statuses),
+        container_reports=[node_status.get('containers') for node_status in statuses],
+        http_clients=[node_status.get('http_client') for node_status in statuses],
+        db_pools=[node_status.get('db_pool') for node_status in statuses],
+        retention_reports=[node_status.get('retention') for node_status in statuses],
+        statuses_age=round(statuses_age),
+        status_times=[node_status.get('time') for node_status in statuses],
         is_prod=is_prod,
         is_dev=is_dev,
         stack_name=stack_name
@@ -0,0 +1,235 @@
+'''Sparse index of the log files, with the byte offset of each minute'''
+import bisect
+import functools
+import json
+import os
+import re
+import sys
+import threading
+from datetime import datetime, timezone, timedelta
+
+import logs # pylint: disable=import-error
+
+
+# Directory of the index files, on a volume so that they are kept between restarts
+INDEX_DIR = os.getenv('LOG_INDEX_DIR', '/mnt/log_index')
+# The beginning of the file is compared to detect a file replaced or truncated in place
+HEAD_BYTES = 256
+# Timestamps are looked for at the beginning of the lines
+PREFIX_BYTES = 160
+# Maximum number of bytes indexed for a file in one update, so that a large file which
+# is not indexed yet does not hold the job for longer than its interval; the next
+# updates continue from there
+MAX_UPDATE_BYTES = 64*1024*1024
+# Timestamp formats, only at the beginning of the lines so that a date in a message is
+# not taken for the time of the line:
+# - ISO 8601 (VuFind, Solr, MariaDB with a space-padded hour), possibly in brackets (the
+#   scripts) or as time="..." (Traefik)
+# - common log format (access logs), after the host, identity (always -) and user
+#   fields, and possibly the virtual host
+# - Apache error log
+ISO_PATTERN = re.compile(
+    rb'(?:\[|time=")?(\d{4})-(\d{2})-(\d{2})[T ] ?(\d{1,2}):(\d{2}):(\d{2})(?:[.,]\d+)?'
+    rb'(Z|[+-]\d{2}:?\d{2})?'
+)
+CLF_PATTERN = re.compile(
+    rb'(?:\S+ )?\S+ - \S+ \[(\d{2})/(\w{3})/(\d{4}):(\d{2}):(\d{2}):(\d{2}) ([+-]\d{4})\]'
+)
+ERROR_LOG_PATTERN = re.compile(
+    rb'\[\w{3} (\w{3}) +(\d{1,2}) (\d{2}):(\d{2}):(\d{2})(?:\.\d+)? (\d{4})\]'
+)
+MONTHS = {
+    b'Jan': 1, b'Feb': 2, b'Mar': 3, b'Apr': 4, b'May': 5, b'Jun': 6,
+    b'Jul': 7, b'Aug': 8, b'Sep': 9, b'Oct': 10, b'Nov': 11, b'Dec': 12,
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _local_time(fields: tuple, offset: bytes | None) -> datetime | None:
+    # Naive local time from the year, month, day, hour, minute, second and UTC offset
+    try:
+        time = datetime(*fields)
+    except ValueError:
+        return None
+    if not offset:
+        return time
+    if offset == b'Z':
+        tz = timezone.utc
+    else:
+        offset = offset.replace(b':', b'')
+        minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+        tz = timezone(timedelta(minutes=-minutes if offset[:1] == b'-' else minutes))
+    return time.replace(tzinfo=tz).astimezone().replace(tzinfo=None)
+
+
+def line_time(line: bytes) -> datetime | None:
+    '''
+    Get the time at the beginning of a log line
+    Args:
+        line (bytes): Line of log
+    Returns:
+        (datetime|None): Local time of the line, or None if it does not start with a timestamp
+    '''
+    prefix = line[:PREFIX_BYTES]
+    match = ISO_PATTERN.match(prefix)
+    if match:
+        return _local_time(tuple(int(group) for group in match.groups()[:6]), match.group(7))
+    match = CLF_PATTERN.match(prefix)
+    if match and match.group(2) in MONTHS:
+        (day, month, year, hour, minute, second, offset) = match.groups()
+        return _local_time(
+            (int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)), offset
+        )
+    match = ERROR_LOG_PATTERN.match(prefix)
+    if match and match.group(1) in MONTHS:
+        (month, day, hour, minute, second, year) = match.groups()
+        return _local_time(
+            (int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)), None
+        )
+    return None
+
+
+class LogIndex():
+    '''
+    Sparse index of a log file: the byte offset of the first line of each minute.
+    It is updated incrementally from the end of the indexed part, and rebuilt when
+    the file is rotated or truncated. The index is saved to a JSON file.
+    '''
+    def __init__(self, path: str, index_path: str):
+        self.path = path
+        self._index_path = index_path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._state = self._empty_state()
+
+    @staticmethod
+    def _empty_state() -> dict:
+        return {'inode': None, 'head': '', 'size': 0, 'minutes': [], 'offsets': []}
+
+    def _read_head(self) -> str:
+        with open(self.path, 'rb') as f:
+            return f.read(HEAD_BYTES).hex()
+
+    def _load(self):
+        # Read the saved index the first time
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._index_path, 'r', encoding='UTF-8') as f:
+                state = json.load(f)
+            state['minutes'] = [datetime.fromisoformat(minute) for minute in state['minutes']]
+            self._state = state
+        except (OSError, ValueError, KeyError) as err:
+            if not isinstance(err, FileNotFoundError):
+                print(f"Error reading the log index {self._index_path}: {err}", file=sys.stderr)
+
+    def _save(self, state: dict):
+        saved = dict(state, minutes=[minute.isoformat() for minute in state['minutes']])
+        os.makedirs(os.path.dirname(self._index_path), exist_ok=True)
+        tmp_path = f'{self._index_path}.tmp'
+        with open(tmp_path, 'w', encoding='UTF-8') as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _is_valid(self, state: dict, inode: int, size: int, head: str) -> bool:
+        # Same file, not truncated; the saved head is compared up to the current head size
+        return state['inode'] == inode and size >= state['size'] and \
+            head.startswith(state['head'][:len(head)]) and \
+            state['head'].startswith(head[:len(state['head'])])
+
+    def update(self):
+        '''
+        Index the lines added since the previous update, or the whole file if it was
+        rotated or truncated, at most MAX_UPDATE_BYTES at a time
+        Raises:
+            OSError: If the file or the index cannot be read or written
+        '''
+        with self._lock:
+            self._load()
+            state = self._state
+        stat = os.stat(self.path)
+        head = self._read_head()
+        if not self._is_valid(state, stat.st_ino, stat.st_size, head):
+            state = self._empty_state()
+        if state['inode'] == stat.st_ino and state['size'] == stat.st_size \
+                and state['head'] == head:
+            return
+        minutes = list(state['minutes'])
+        offsets = list(state['offsets'])
+        offset = state['size']
+        end = offset + MAX_UPDATE_BYTES
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n') or offset >= end:
+                    # Partial line, or enough for this update: indexed at the next one
+                    break
+                time = line_time(line)
+                if time is not None:
+                    minute = time.replace(second=0)
+                    if not minutes or minute > minutes[-1]:
+                        minutes.append(minute)
+                        offsets.append(offset)
+                offset += len(line)
+        state = {
+            'inode': stat.st_ino, 'head': head, 'size': offset, 'minutes': minutes,
+            'offsets': offsets,
+        }
+        self._save(state)
+        with self._lock:
+            self._state = state
+
+    def offset(self, time: datetime) -> int | None:
+        '''
+        Get the offset where to start reading the file to find the lines at or after a time
+        Args:
+            time (datetime): Local time
+        Returns:
+            (int|None): Offset of the first line of the last indexed minute before the time,
+                or None if the index does not match the file
+        '''
+        with self._lock:
+            self._load()
+            state = self._state
+        try:
+            stat = os.stat(self.path)
+            head = self._read_head()
+        except OSError:
+            return None
+        if not self._is_valid(state, stat.st_ino, stat.st_size, head):
+            return None
+        i = bisect.bisect_right(state['minutes'], time) - 1
+        return 0 if i < 0 else state['offsets'][i]
+
+
+_indexes = {
+    path: LogIndex(path, f"{INDEX_DIR}/{service.replace('/', '_')}.json")
+    for service, path in logs.LOG_PATHS.items()
+}
+
+
+def start_offset(path: str, time: datetime) -> int | None:
+    '''
+    Get the offset where to start reading a log file to find the lines at or after a time
+    Args:
+        path (str): Path of one of the log files in logs.LOG_PATHS
+        time (datetime): Local time
+    Returns:
+        (int|None): Offset (see LogIndex.offset), or None if the file is not indexed
+    '''
+    index = _indexes.get(str(path))
+    return None if index is None else index.offset(time)
+
+
+def main():
+    '''
+    Update the index of each log file, called regularly by the scheduler
+    '''
+    for path, index in _indexes.items():
+        if not os.path.isfile(path):
+            continue
+        try:
+            index.update()
+        except OSError as err:
+            print(f"Error updating the log index of {path}: {err}", file=sys.stderr)
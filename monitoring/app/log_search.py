@@ -0,0 +1,221 @@
+'''Search in the log files, line by line'''
+import asyncio
+import collections
+import json
+import os
+import re
+import urllib.parse
+from datetime import datetime, timedelta
+import quart
+import aiohttp
+
+import log_index # pylint: disable=import-error
+import logs # pylint: disable=import-error
+import util # pylint: disable=import-error
+
+
+NODES = [1, 2, 3]
+DEFAULT_MAX_MATCHES = 1000
+MAX_MATCHES = 10000
+# A search reads all the files of the log, which can take longer than the other requests
+SEARCH_TIMEOUT = 120
+SEARCH_PARAMETERS = ['q', 'regex', 'start', 'end', 'severity', 'max']
+# The lines are not always in chronological order (Apache writes the access log lines
+# when the requests end, with the time they started): the search only stops reading a
+# file after a line this much later than the end of the range
+END_TOLERANCE = timedelta(minutes=1)
+# Severities from the lowest to the highest, with the words used for them in the logs
+SEVERITIES = ['debug', 'info', 'notice', 'warning', 'error', 'critical']
+SEVERITY_WORDS = {
+    b'debug': 0, b'info': 1, b'notice': 2, b'note': 2, b'warn': 3, b'warning': 3,
+    b'err': 4, b'error': 4, b'crit': 5, b'critical': 5, b'fatal': 5, b'alert': 5,
+    b'emerg': 5, b'severe': 5,
+}
+SEVERITY_PATTERN = re.compile(
+    rb'\b(' + b'|'.join(sorted(SEVERITY_WORDS, key=len, reverse=True)) + rb')\b', re.IGNORECASE
+)
+
+
+def line_severity(line: bytes) -> int | None:
+    '''
+    Get the severity of a log line, from the first severity word in its beginning
+    Args:
+        line (bytes): Line of log
+    Returns:
+        (int|None): Index in SEVERITIES, or None if not found
+    '''
+    match = SEVERITY_PATTERN.search(line[:log_index.PREFIX_BYTES])
+    return None if match is None else SEVERITY_WORDS[match.group(1).lower()]
+
+
+def _parse_time(value: str | None) -> datetime | None | str:
+    # Naive local time, like the times of the lines (see log_index.line_time)
+    if not value:
+        return None
+    try:
+        # fromisoformat only accepts Z from Python 3.11
+        time = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return f'Error: invalid time: {value}'
+    if time.tzinfo is not None:
+        time = time.astimezone().replace(tzinfo=None)
+    return time
+
+
+def _parse_max(value: str | None) -> int | str:
+    if not value:
+        return DEFAULT_MAX_MATCHES
+    try:
+        max_matches = int(value)
+    except ValueError:
+        return 'Error: invalid maximum number of matches'
+    if max_matches < 1:
+        return 'Error: the maximum number of matches should be at least 1'
+    return min(max_matches, MAX_MATCHES)
+
+
+def _search_file(path, pattern: re.Pattern, filters: dict, matches: collections.deque) -> int:
+    # Scan a file line by line, adding the matches; continuation lines (without timestamp,
+    # like stack traces) get the time and severity of the line they continue
+    found = 0
+    time = None
+    severity = None
+    with logs.open_log(path) as f:
+        if filters['start'] is not None:
+            # Start from the minute of the start of the range, if the file is indexed
+            f.seek(log_index.start_offset(path, filters['start']) or 0)
+        for line in f:
+            new_time = log_index.line_time(line)
+            if new_time is not None:
+                time = new_time
+                if filters['severity'] is not None:
+                    severity = line_severity(line)
+            if time is not None:
+                if filters['end'] is not None and time > filters['end']:
+                    if time > filters['end'] + END_TOLERANCE:
+                        # The lines are in chronological order, give or take END_TOLERANCE
+                        break
+                    continue
+                if filters['start'] is not None and time < filters['start']:
+                    continue
+            elif filters['start'] is not None:
+                continue
+            if filters['severity'] is not None and (severity is None or
+                    severity < filters['severity']):
+                continue
+            if pattern.search(line):
+                found += 1
+                matches.append({
+                    'file': path.name,
+                    'time': None if time is None else time.isoformat(sep=' '),
+                    'text': line.decode('utf8', errors='ignore').rstrip('\n'),
+                })
+    return found
+
+
+def node_log_search(service: str, args: dict) -> dict | str:
+    '''
+    Search the log files of a service on this node, including the rotated ones,
+    reading them line by line from the oldest to the newest
+    Args:
+        service (str): Service to search the logs of
+        args (dict): Search parameters, all optional:
+            q: Text or regular expression to look for (default: all the lines)
+            regex: Present if q is a regular expression
+            start: Only lines at or after this time, in ISO format
+            end: Only lines at or before this time, in ISO format
+            severity: Only lines with at least this severity, one of SEVERITIES
+            max: Maximum number of matching lines returned (the most recent ones)
+    Returns:
+        (dict|str): Matching lines (with their file, time and text), total number of
+            matches, and whether the list was truncated; or error message
+    '''
+    paths = logs.log_paths(service)
+    if isinstance(paths, str):
+        return paths
+    query = args.get('q')
+    try:
+        pattern = re.compile(query.encode() if 'regex' in args else re.escape(query.encode())) \
+            if query else re.compile(b'')
+    except re.error as err:
+        return f'Error: invalid regular expression: {err}'
+    filters = {
+        'start': _parse_time(args.get('start')), 'end': _parse_time(args.get('end')),
+        'severity': None,
+    }
+    for name in ('start', 'end'):
+        if isinstance(filters[name], str):
+            return filters[name]
+    severity = args.get('severity')
+    if severity:
+        if severity not in SEVERITIES:
+            return 'Error: unknown severity'
+        filters['severity'] = SEVERITIES.index(severity)
+    max_matches = _parse_max(args.get('max'))
+    if isinstance(max_matches, str):
+        return max_matches
+    matches = collections.deque(maxlen=max_matches)
+    total = 0
+    for path in paths:
+        if filters['start'] is not None and \
+                datetime.fromtimestamp(os.path.getmtime(path)) < filters['start']:
+            # Not modified since the start of the range
+            continue
+        total += _search_file(path, pattern, filters, matches)
+    return {'matches': list(matches), 'total': total, 'truncated': total > len(matches)}
+
+
+async def _node_search(node: int, service: str, params: dict) -> dict:
+    url = f'http://monitoring{node}/monitoring/node/log_search/{service}?' \
+        f'{urllib.parse.urlencode(params)}'
+    try:
+        [result] = await util.async_multiple_get([url], timeout=SEARCH_TIMEOUT)
+    except aiohttp.ClientError as err:
+        return {'error': f'Error searching the {service} log: {err}'}
+    except asyncio.exceptions.TimeoutError:
+        return {'error': f'Timeout when searching the {service} log'}
+    try:
+        return json.loads(result)
+    except json.JSONDecodeError:
+        # Error message from the node
+        return {'error': result}
+
+
+async def log_search(service: str, args: dict) -> str:
+    '''
+    Search the logs of a service on all the nodes, and render the results
+    Args:
+        service (str): Service to search the logs of
+        args (dict): Search parameters (q, regex, start, end, severity, max), see
+            node_log_search; no search is done without q
+    Returns:
+        (str): Page with the search form, and the matching lines of all the nodes
+            sorted by time
+    '''
+    params = {name: args[name] for name in SEARCH_PARAMETERS if args.get(name)}
+    matches = None
+    errors = {}
+    truncated = False
+    if 'q' in args:
+        results = await asyncio.gather(*(_node_search(node, service, params) for node in NODES))
+        matches = []
+        for node, result in zip(NODES, results):
+            if 'error' in result:
+                errors[node] = result['error']
+                continue
+            truncated = truncated or result['truncated']
+            matches.extend(dict(match, node=node) for match in result['matches'])
+        # Sorted by time, keeping the order of each node for the lines with the same time
+        matches.sort(key=lambda match: match['time'] or '')
+        try:
+            max_matches = min(int(args.get('max') or DEFAULT_MAX_MATCHES), MAX_MATCHES)
+        except ValueError:
+            max_matches = DEFAULT_MAX_MATCHES
+        if len(matches) > max_matches:
+            matches = matches[len(matches) - max_matches:]
+            truncated = True
+    return await quart.render_template(
+        'log_search.html',
+        service=service, args=args, severities=SEVERITIES, matches=matches, errors=errors,
+        truncated=truncated, stack_name=os.getenv('STACK_NAME')
+    )
@@ -0,0 +1,343 @@
+'''Live tail of the log files, sent with Server-Sent Events'''
+import asyncio
+import ctypes
+import json
+import os
+import pathlib
+import re
+from typing import AsyncIterator
+import aiohttp
+
+import logs # pylint: disable=import-error
+import util # pylint: disable=import-error
+
+
+NODES = [1, 2, 3]
+# Bytes of the end of the file sent when starting to follow it
+INITIAL_BYTES = 16*1024
+READ_CHUNK_SIZE = 256*1024
+# Interval to check the file without inotify, and to send a comment to keep the
+# connection open (also used to check the file with inotify, in case an event was missed)
+POLL_INTERVAL = 1
+KEEPALIVE_INTERVAL = 15
+# Delays before reconnecting to a node after its event stream ended or failed, doubled
+# after each failure
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+# inotify flags, from sys/inotify.h
+IN_MODIFY = 0x2
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# Headers for the event streams; X-Accel-Buffering disables the buffering by nginx
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+class _Inotify():
+    '''
+    inotify watch on a directory, to be woken up when the files in it are modified,
+    created or replaced
+    '''
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_MODIFY | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self._fd, directory.encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f'inotify_add_watch failed for {directory}')
+
+    async def wait(self, timeout: float):
+        '''
+        Wait for an event, or the timeout
+        Args:
+            timeout (float): Maximum time to wait, in seconds
+        '''
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        loop.add_reader(self._fd, event.set)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self._fd)
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        '''
+        Remove the watch
+        '''
+        os.close(self._fd)
+
+
+class _Poller(): # pylint: disable=too-few-public-methods
+    '''
+    Fallback when inotify is not available: wait for the polling interval
+    '''
+    async def wait(self, timeout: float):
+        '''
+        Wait for the polling interval, or the timeout if shorter
+        Args:
+            timeout (float): Maximum time to wait, in seconds
+        '''
+        await asyncio.sleep(min(timeout, POLL_INTERVAL))
+
+    def close(self):
+        '''
+        Nothing to release
+        '''
+
+
+def _watcher(directory: str) -> _Inotify | _Poller:
+    try:
+        return _Inotify(directory)
+    except (OSError, AttributeError):
+        return _Poller()
+
+
+class LogFollower():
+    '''
+    Follow a log file like `tail -F`: the file stays open to read the end of a rotated
+    file, then the new file is read from its beginning. A truncation is detected too.
+    '''
+    def __init__(self, path: pathlib.Path, resume: tuple[int, int] | None = None):
+        self.path = path
+        self.inode = None
+        self._file = None
+        self._partial = b''
+        self._resume = resume
+
+    def _open(self, offset: int | None) -> bool:
+        try:
+            self._file = open(self.path, 'rb') # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            return False
+        stat = os.fstat(self._file.fileno())
+        self.inode = stat.st_ino
+        self._partial = b''
+        if self._resume is not None and self._resume[0] == stat.st_ino:
+            # Resume from an offset only in the same file
+            offset = self._resume[1]
+        self._resume = None
+        if offset is None or offset > stat.st_size:
+            # Start with the last lines, skipping the first partial line
+            offset = max(0, stat.st_size - INITIAL_BYTES)
+            self._file.seek(offset)
+            if offset > 0:
+                self._file.readline()
+        else:
+            self._file.seek(offset)
+        return True
+
+    def close(self):
+        '''
+        Close the file
+        '''
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+    def _read_lines(self) -> list[tuple[int, int, bytes]]:
+        lines = []
+        while True:
+            chunk = self._file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return lines
+            data = self._partial + chunk
+            end = self._file.tell() - len(data)
+            parts = data.split(b'\n')
+            self._partial = parts.pop()
+            for part in parts:
+                end += len(part) + 1
+                lines.append((self.inode, end, part.rstrip(b'\r')))
+
+    def read(self) -> tuple[list[tuple[int, int, bytes]], bool]:
+        '''
+        Read the lines added since the previous call
+        Returns:
+            (tuple): List of the new lines with the inode of their file and the offset
+                after each of them (after a rotation, the last lines of the old file come
+                first), and whether the file was rotated or truncated
+        '''
+        if self._file is None:
+            opened = self._open(None)
+            return ([], False) if not opened else (self._read_lines(), False)
+        lines = self._read_lines()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return (lines, False)
+        if stat.st_ino != self.inode:
+            # Rotated: the end of the old file has been read, continue with the new one
+            self.close()
+            if self._open(0):
+                lines.extend(self._read_lines())
+            return (lines, True)
+        if stat.st_size < self._file.tell():
+            # Truncated in place (copytruncate)
+            self._file.seek(0)
+            self._partial = b''
+            return (lines + self._read_lines(), True)
+        return (lines, False)
+
+
+def _event(data: str, event: str | None = None, event_id: str | None = None) -> str:
+    text = '' if event is None else f'event: {event}\n'
+    if event_id is not None:
+        text += f'id: {event_id}\n'
+    return text + ''.join(f'data: {line}\n' for line in data.split('\n')) + '\n'
+
+
+async def node_tail(service: str, last_event_id: str | None = None) -> AsyncIterator[str]:
+    '''
+    Follow the current log file of a service on this node, as Server-Sent Events:
+    one event per line (with the inode of the file and the offset after the line as id,
+    to resume after a reconnection),
+    a 'rotate' event when the file is rotated, and an 'error' event for an unknown service
+    Args:
+        service (str): Service to follow the log of
+        last_event_id (str): Inode and offset to resume from, sent by the browser when
+            reconnecting
+    Returns:
+        (AsyncIterator): Yields the events
+    '''
+    if service not in logs.LOG_PATHS:
+        yield _event('Error: unknown service.', 'error')
+        return
+    path = pathlib.Path(logs.LOG_PATHS[service])
+    resume = None
+    if last_event_id and re.fullmatch(r'\d+:\d+', last_event_id):
+        resume = tuple(int(value) for value in last_event_id.split(':'))
+    follower = LogFollower(path, resume)
+    watcher = _watcher(str(path.parent))
+    loop = asyncio.get_running_loop()
+    try:
+        last_sent = loop.time()
+        while True:
+            (lines, rotated) = await asyncio.to_thread(follower.read)
+            if rotated:
+                yield _event(path.name, 'rotate')
+            for (inode, end, line) in lines:
+                yield _event(line.decode('utf8', errors='ignore'), event_id=f'{inode}:{end}')
+            if lines or rotated:
+                last_sent = loop.time()
+            elif loop.time() - last_sent >= KEEPALIVE_INTERVAL:
+                yield ': keepalive\n\n'
+                last_sent = loop.time()
+            await watcher.wait(KEEPALIVE_INTERVAL)
+    finally:
+        watcher.close()
+        follower.close()
+
+
+async def _read_node(node: int, service: str, queue: asyncio.Queue, last_ids: dict) -> bool:
+    # Parse the events from a node and put them in the queue, with the node and the id of
+    # the last line received (kept in last_ids to resume); returns whether the node sent
+    # an error (the stream is not resumed)
+    url = f'http://monitoring{node}/monitoring/node/logs/{service}/tail'
+    headers = {'Last-Event-ID': last_ids[node]} if node in last_ids else None
+    buffer = ''
+    async for chunk in util.async_stream_get(url, timeout=KEEPALIVE_INTERVAL * 2,
+            headers=headers):
+        buffer += chunk.decode('utf8', errors='ignore')
+        while '\n\n' in buffer:
+            (block, buffer) = buffer.split('\n\n', 1)
+            event = 'message'
+            data = []
+            for field in block.split('\n'):
+                if field.startswith('event: '):
+                    event = field[len('event: '):]
+                elif field.startswith('id: '):
+                    last_ids[node] = field[len('id: '):]
+                elif field.startswith('data: '):
+                    data.append(field[len('data: '):])
+            if data:
+                message = {'node': node, 'event': event, 'line': '\n'.join(data)}
+                await queue.put((message, last_ids.get(node)))
+            if event == 'error':
+                return True
+    return False
+
+
+async def _forward_node(node: int, service: str, queue: asyncio.Queue, last_ids: dict):
+    # Forward the events of a node, reconnecting (and resuming after the last line
+    # received) with an increasing delay when the stream ends or fails; a failure is only
+    # reported once until the stream works again
+    delay = RECONNECT_DELAY
+    reported = False
+    while True:
+        received = last_ids.get(node)
+        error = None
+        try:
+            if await _read_node(node, service, queue, last_ids):
+                return
+            error = 'Connection closed'
+        except aiohttp.ClientError as err:
+            error = f'Error following the log: {err}'
+        except asyncio.exceptions.TimeoutError:
+            error = 'Timeout following the log'
+        if last_ids.get(node) != received:
+            delay = RECONNECT_DELAY
+            reported = False
+        if not reported:
+            message = {'node': node, 'event': 'error', 'line': f'{error}, reconnecting'}
+            await queue.put((message, last_ids.get(node)))
+            reported = True
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+def _parse_last_ids(last_event_id: str | None) -> dict:
+    # Id of the last line of each node, from an id sent by tail
+    last_ids = {}
+    for part in (last_event_id or '').split(','):
+        match = re.fullmatch(r'(\d+)=(\d+:\d+)', part)
+        if match and int(match.group(1)) in NODES:
+            last_ids[int(match.group(1))] = match.group(2)
+    return last_ids
+
+
+async def tail(service: str, last_event_id: str | None = None) -> AsyncIterator[str]:
+    '''
+    Follow the log of a service on all the nodes, as Server-Sent Events with the lines
+    interleaved as they arrive, each one as JSON with the node, the event type
+    (see node_tail) and the line. The id of each event has the id of the last line
+    received from each node (like 1=inode:offset,2=inode:offset), to resume after a
+    reconnection; the streams of the nodes are resumed the same way when they fail.
+    Args:
+        service (str): Service to follow the log of
+        last_event_id (str): Ids of the last lines to resume from, sent by the browser
+            when reconnecting
+    Returns:
+        (AsyncIterator): Yields the events
+    '''
+    queue = asyncio.Queue(maxsize=1000)
+    # Ids of the last lines received from the nodes, and of the last lines sent
+    last_ids = _parse_last_ids(last_event_id)
+    sent_ids = dict(last_ids)
+    tasks = [
+        asyncio.create_task(_forward_node(node, service, queue, last_ids)) for node in NODES
+    ]
+    try:
+        while True:
+            try:
+                (message, line_id) = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if line_id is not None:
+                sent_ids[message['node']] = line_id
+            event_id = ','.join(f'{node}={sent_ids[node]}' for node in sorted(sent_ids))
+            yield _event(json.dumps(message), event_id=event_id or None)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,139 +1,373 @@
 '''Log reader'''
 import pathlib
 import asyncio
+import codecs
+import collections
 import gzip
+import io
+import json
 import os
 import re
-import shutil
-import subprocess
-import tempfile
-import flask
+import urllib.parse
+from typing import AsyncIterator, Iterator
+import quart
 import aiohttp
 
 import util # pylint: disable=import-error
 
 
+# Main log file of each service; older logs are rotated to .1, .2.gz and .3.gz
+LOG_PATHS = {
+    'vufind':                  '/mnt/logs/vufind/vufind.log',
+    'apache/error':            '/mnt/logs/apache/error.log',
+    'apache/access':           '/mnt/logs/apache/access.log',
+    'simplesamlphp':           '/mnt/logs/simplesamlphp/simplesamlphp.log',
+    'mariadb':                 '/mnt/logs/mariadb/mysqld.log',
+    'traefik/log':             '/mnt/traefik_logs/traefik.log',
+    'traefik/access':          '/mnt/traefik_logs/access.log',
+    'harvests/folio':          '/mnt/logs/harvests/folio.log',
+    'harvests/hlm':            '/mnt/logs/harvests/hlm.log',
+    'harvests/dr':             '/mnt/logs/harvests/dr.log',
+    'harvests/authority':      '/mnt/logs/harvests/authority.log',
+    'vufind/reserves_update':  '/mnt/logs/vufind/reserves_update.log',
+    'vufind/optimize':         '/mnt/logs/vufind/optimize_cleanup.log',
+    'alphabrowse':             '/mnt/logs/alphabrowse/alphabrowse.log',
+    'vufind/searches_cleanup': '/mnt/logs/vufind/searches_cleanup.log',
+    'vufind/sessions_cleanup': '/mnt/logs/vufind/sessions_cleanup.log',
+    'backups/solr':            '/mnt/logs/backups/solr.log',
+    'backups/db':              '/mnt/logs/backups/db.log',
+    'backups/alpha':           '/mnt/logs/backups/alpha.log',
+    'solr':                    '/mnt/logs/solr/solr.log'
+}
+
 MAX_FULL_FILE = 10*1024*1024 # Max file size to return the full contents; arbitrary 10 MB
 BEGIN_END_BYTES = MAX_FULL_FILE // 2
-TIMEOUT = 10
+CHUNK_SIZE = 64*1024
+# Default and maximum size of a page of log, and maximum number of lines
+PAGE_BYTES = 256*1024
+MAX_PAGE_BYTES = 4*1024*1024
+MAX_PAGE_LINES = 20000
+PAGE_DIRECTIONS = ['older', 'newer']
+PAGE_PARAMETERS = ['file', 'offset', 'limit', 'unit', 'direction']
+PAGE_UNITS = ['bytes', 'lines']
+SECTION_SEPARATOR = '\n---------------------------\n\n'
 
 
-def _read_beginning_and_end(path: str) -> str:
-    command = f'head -c {BEGIN_END_BYTES} {path}; echo -e "\n\n[...]\n";' \
-        f'tail -c {BEGIN_END_BYTES} {path}'
-    try:
-        process = subprocess.run(["/bin/sh", "-c", command],
-            capture_output=True, text=True, timeout=TIMEOUT, check=True)
-    except subprocess.CalledProcessError as err:
-        return f"Error reading log file {path}: {err.stderr}\n"
-    except subprocess.TimeoutExpired:
-        return f"Timeout reading log file {path}\n"
-    return process.stdout
-
-
-def _add_uncompressed_file_to_log(path: str, full_log: str) -> str:
-    if path.stat().st_size > MAX_FULL_FILE:
-        log_text = 'Detected a large file. Showing beginning and end...\n' \
-            f'{_read_beginning_and_end(path)}'
-    else:
-        log_text = path.read_text(encoding="utf8", errors="ignore")
-
-    if log_text != '':
-        log_text = path.name + ':\n' + log_text
-        if full_log != '':
-            full_log = '\n---------------------------\n\n' + full_log
-        full_log = log_text + full_log
-
-    return full_log
-
-
-def _add_file_to_log(path: str, full_log: str) -> str:
-    if path.name.endswith('.gz'):
-        with tempfile.TemporaryDirectory() as tmp_dir_name:
-            tmp_path = pathlib.Path(os.path.join(tmp_dir_name, path.name))
-            with gzip.open(path, 'rb') as f_in:
-                with open(tmp_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            return _add_uncompressed_file_to_log(tmp_path, full_log)
-    return _add_uncompressed_file_to_log(path, full_log)
-
-
-def node_logs(service: str) -> str:
+def _read_chunks(f, size: int | None = None) -> Iterator[str]:
+    # Read and decode up to `size` bytes (all by default), one chunk at a time
+    decoder = codecs.getincrementaldecoder('utf8')(errors='ignore')
+    remaining = size
+    while remaining is None or remaining > 0:
+        chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def _file_size(path: pathlib.Path) -> int:
+    # Size of the contents; for compressed files, from the gzip trailer (modulo 4 GB)
+    if not path.name.endswith('.gz'):
+        return path.stat().st_size
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), 'little')
+
+
+def open_log(path: pathlib.Path):
     '''
-    Gets the file path to the log for a particular service
+    Open a log file for reading in binary mode; compressed files are decompressed
+    while reading, without a temporary copy
     Args:
-        service (str): Service to get the path for
+        path (Path): Path of the file
     Returns:
-        (str): Path to the log
+        (file): File object
     '''
-    paths = {
-        'vufind':                  '/mnt/logs/vufind/vufind.log',
-        'apache/error':            '/mnt/logs/apache/error.log',
-        'apache/access':           '/mnt/logs/apache/access.log',
-        'simplesamlphp':           '/mnt/logs/simplesamlphp/simplesamlphp.log',
-        'mariadb':                 '/mnt/logs/mariadb/mysqld.log',
-        'traefik/log':             '/mnt/traefik_logs/traefik.log',
-        'traefik/access':          '/mnt/traefik_logs/access.log',
-        'harvests/folio':          '/mnt/logs/harvests/folio.log',
-        'harvests/hlm':            '/mnt/logs/harvests/hlm.log',
-        'harvests/dr':             '/mnt/logs/harvests/dr.log',
-        'harvests/authority':      '/mnt/logs/harvests/authority.log',
-        'vufind/reserves_update':  '/mnt/logs/vufind/reserves_update.log',
-        'vufind/optimize':         '/mnt/logs/vufind/optimize_cleanup.log',
-        'alphabrowse':             '/mnt/logs/alphabrowse/alphabrowse.log',
-        'vufind/searches_cleanup': '/mnt/logs/vufind/searches_cleanup.log',
-        'vufind/sessions_cleanup': '/mnt/logs/vufind/sessions_cleanup.log',
-        'backups/solr':            '/mnt/logs/backups/solr.log',
-        'backups/db':              '/mnt/logs/backups/db.log',
-        'backups/alpha':           '/mnt/logs/backups/alpha.log',
-        'solr':                    '/mnt/logs/solr/solr.log'
-    }
-    if service not in paths:
-        return 'Error: unknown service.'
+    return gzip.open(path, 'rb') if path.name.endswith('.gz') else open(path, 'rb')
 
-    path = pathlib.Path(paths[service])
-    full_log = ''
 
-    latest_matching_paths = path.parent.glob(re.sub(r"\.log", "_latest.log.*", path.name))
-    for latest_path in latest_matching_paths:
-        full_log = _add_file_to_log(latest_path, full_log)
+def _read_tail(f, size: int) -> Iterator[str]:
+    # Read the stream to the end, keeping only the last `size` bytes in a ring buffer
+    ring = collections.deque()
+    ring_size = 0
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        ring.append(chunk)
+        ring_size += len(chunk)
+        while ring_size - len(ring[0]) >= size:
+            ring_size -= len(ring.popleft())
+    tail = io.BytesIO(b''.join(ring)[-size:])
+    del ring
+    yield from _read_chunks(tail)
 
+
+def _read_file(path: pathlib.Path) -> Iterator[str]:
+    compressed = path.name.endswith('.gz')
+    size = _file_size(path)
+    if compressed:
+        # The trailer size is wrong for files larger than 4 GB
+        size = max(size, path.stat().st_size)
+    with open_log(path) as f:
+        if size <= MAX_FULL_FILE:
+            yield from _read_chunks(f)
+            return
+        yield 'Detected a large file. Showing beginning and end...\n'
+        yield from _read_chunks(f, BEGIN_END_BYTES)
+        yield '\n\n[...]\n\n'
+        if compressed:
+            yield from _read_tail(f, BEGIN_END_BYTES)
+        else:
+            f.seek(-BEGIN_END_BYTES, os.SEEK_END)
+            yield from _read_chunks(f)
+
+
+def log_paths(service: str) -> list[pathlib.Path] | str:
+    '''
+    Get the log files of a service on this node
+    Args:
+        service (str): Service to get the files for
+    Returns:
+        (list|str): Paths of the files, from the oldest to the newest, or error message
+    '''
+    if service not in LOG_PATHS:
+        return 'Error: unknown service.'
+    path = pathlib.Path(LOG_PATHS[service])
     if not path.is_file():
         return f'Log file does not exist on this node: {path.name}'
-    full_log = _add_file_to_log(path, full_log)
+    paths = []
+    rotated_1 = pathlib.Path(f'{path}.1')
+    if rotated_1.is_file():
+        for i in range(3, 1, -1):
+            rotated_gz = pathlib.Path(f'{path}.{i}.gz')
+            if rotated_gz.is_file():
+                paths.append(rotated_gz)
+        paths.append(rotated_1)
+    paths.append(path)
+    paths.extend(sorted(path.parent.glob(re.sub(r"\.log", "_latest.log.*", path.name)),
+        reverse=True))
+    return paths
+
+
+def node_logs(service: str) -> Iterator[str]:
+    '''
+    Read the log files of a service on this node, from the oldest to the newest,
+    a chunk at a time
+    Args:
+        service (str): Service to get the logs for
+    Returns:
+        (Iterator): Yields the contents of the files, with the name of each file,
+            or an error message
+    '''
+    paths = log_paths(service)
+    if isinstance(paths, str):
+        yield paths
+        return
+    first = True
+    for path in paths:
+        header = ('' if first else SECTION_SEPARATOR) + path.name + ':\n'
+        for chunk in _read_file(path):
+            if not chunk:
+                continue
+            if header is not None:
+                # Empty files are skipped
+                yield header
+                header = None
+                first = False
+            yield chunk
+
+
+async def node_logs_stream(service: str) -> AsyncIterator[str]:
+    '''
+    Read the log files of a service on this node without blocking the event loop,
+    see node_logs
+    Args:
+        service (str): Service to get the logs for
+    Returns:
+        (AsyncIterator): Yields the contents of the files
+    '''
+    chunks = node_logs(service)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
 
-    rotated_1 = pathlib.Path(f'{paths[service]}.1')
-    if not rotated_1.is_file():
-        return full_log
-    full_log = _add_file_to_log(rotated_1, full_log)
 
-    for i in range(2, 4):
-        rotated_gz = pathlib.Path(f'{paths[service]}.{i}.gz')
-        if rotated_gz.is_file():
-            full_log = _add_file_to_log(rotated_gz, full_log)
+def _read_newer(f, size: int, offset: int, max_bytes: int,
+        max_lines: int | None) -> tuple[int, bytes]:
+    # Read the lines starting at offset, ending on a line boundary
+    f.seek(offset)
+    data = f.read(max_bytes)
+    if max_lines is not None:
+        data = b''.join(data.splitlines(keepends=True)[:max_lines])
+    if offset + len(data) < size and not data.endswith(b'\n'):
+        # Cut the last partial line, unless the page is within a single long line
+        newline = data.rfind(b'\n')
+        if newline >= 0:
+            data = data[:newline + 1]
+    return (offset, data)
 
-    return full_log
 
+def _read_older(f, offset: int, max_bytes: int, max_lines: int | None) -> tuple[int, bytes]:
+    # Read the lines ending at offset, starting on a line boundary
+    begin = max(0, offset - max_bytes)
+    f.seek(begin)
+    data = f.read(offset - begin)
+    if begin > 0:
+        # Cut the first partial line, unless the page is within a single long line
+        newline = data.find(b'\n')
+        if 0 <= newline < len(data) - 1:
+            data = data[newline + 1:]
+    if max_lines is not None:
+        data = b''.join(data.splitlines(keepends=True)[-max_lines:])
+    return (offset - len(data), data)
 
-def logs_vufind(service: str) -> list:
+
+def _page_limits(limit: str | None, unit: str) -> tuple[int, int | None] | str:
+    # Maximum number of bytes and lines
+    if unit not in PAGE_UNITS:
+        return 'Error: unknown unit'
+    if limit is None:
+        return (PAGE_BYTES, None)
+    try:
+        limit = int(limit)
+    except ValueError:
+        return 'Error: invalid limit'
+    if limit <= 0:
+        return 'Error: invalid limit'
+    if unit == 'lines':
+        return (MAX_PAGE_BYTES, min(limit, MAX_PAGE_LINES))
+    return (min(limit, MAX_PAGE_BYTES), None)
+
+
+def node_log_page(service: str, args: dict) -> dict | str: # pylint: disable=too-many-locals
     '''
-    Get ths logs for a service
+    Read a page of a log file of a service on this node, aligned on line boundaries,
+    seeking directly to the page
     Args:
-        service (str): Name of the service to get the logs for
+        service (str): Service to get the logs for
+        args (dict): Paging parameters, as strings like the request parameters:
+            - file: Name of the file (default: the current log file)
+            - offset: Byte offset where the page ends (older) or starts (newer), normally
+              from a cursor of the previous page; default: end of the file for older,
+              start for newer. The other end of the page is aligned on a line boundary.
+            - limit: Maximum size of the page (default: PAGE_BYTES)
+            - unit: Unit of the limit, 'bytes' (default) or 'lines'
+            - direction: 'older' (default) to read before offset, 'newer' to read after
+    Returns:
+        (dict|str): File name, names of the files from the oldest to the newest, size,
+            byte range and text of the page, and the cursors (file and offset) to read
+            the older and newer pages (None if there are none), or error message
+    '''
+    paths = log_paths(service)
+    if isinstance(paths, str):
+        return paths
+    names = [path.name for path in paths]
+    file = args.get('file') or pathlib.Path(LOG_PATHS[service]).name
+    direction = args.get('direction', 'older')
+    if file not in names:
+        return 'Error: unknown file'
+    if direction not in PAGE_DIRECTIONS:
+        return 'Error: unknown direction'
+    limits = _page_limits(args.get('limit'), args.get('unit', 'bytes'))
+    if isinstance(limits, str):
+        return limits
+    (max_bytes, max_lines) = limits
+    index = names.index(file)
+    path = paths[index]
+    size = _file_size(path)
+    offset = args.get('offset')
+    try:
+        offset = None if offset is None else min(max(int(offset), 0), size)
+    except ValueError:
+        return 'Error: invalid offset'
+    with open_log(path) as f:
+        if direction == 'older':
+            (start, data) = _read_older(f, size if offset is None else offset, max_bytes,
+                max_lines)
+        else:
+            (start, data) = _read_newer(f, size, offset or 0, max_bytes, max_lines)
+    end = start + len(data)
+    older = None
+    if start > 0:
+        older = {'file': file, 'offset': start}
+    elif index > 0:
+        older = {'file': names[index - 1], 'offset': None}
+    newer = {'file': file, 'offset': end}
+    if end >= size and index < len(names) - 1:
+        newer = {'file': names[index + 1], 'offset': 0}
+    return {
+        'file': file, 'files': names, 'size': size, 'start': start, 'end': end,
+        'text': data.decode('utf8', errors='ignore'), 'older': older, 'newer': newer,
+    }
+
+
+async def _node_log_chunks(node: int, service: str) -> AsyncIterator[str]:
+    # Stream the log from a node, with errors at the end of its section
+    decoder = codecs.getincrementaldecoder('utf8')(errors='ignore')
+    url = f'http://monitoring{node}/monitoring/node/logs/{service}'
+    try:
+        async for chunk in util.async_stream_get(url):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+    except aiohttp.ClientError as err:
+        yield f'\nError reading the {service} log: {err}'
+    except asyncio.exceptions.TimeoutError:
+        yield f'\nTimeout when reading the {service} log'
+
+
+async def log_page(node: int, service: str, args: dict) -> dict:
+    '''
+    Get a page of a log file of a service from a node
+    Args:
+        node (int): Node to read the log from
+        service (str): Service to get the logs for
+        args (dict): Paging parameters (see node_log_page)
     Returns:
-        (list): Logs from all of the nodes
+        (dict): See node_log_page, or an error message in 'error'
     '''
-    urls = []
-    for node in range(1, 4):
-        urls.append(f'http://monitoring{node}/monitoring/node/logs/{service}')
+    if node not in range(1, 4):
+        return {'error': 'Error: unknown node'}
+    params = {name: args[name] for name in PAGE_PARAMETERS if name in args}
+    params.setdefault('direction', 'older')
+    url = f'http://monitoring{node}/monitoring/node/logs/{service}?{urllib.parse.urlencode(params)}'
     try:
-        logs = util.multiple_get(urls)
+        [page] = await util.async_multiple_get([url])
     except aiohttp.ClientError as err:
-        return f'Error reading the {service} log: {err}'
+        return {'error': f'Error reading the {service} log: {err}'}
     except asyncio.exceptions.TimeoutError:
-        return f'Timeout when reading the {service} log'
-    return flask.render_template(
+        return {'error': f'Timeout when reading the {service} log'}
+    try:
+        return json.loads(page)
+    except json.JSONDecodeError:
+        # Error message from the node
+        return {'error': page}
+
+
+async def logs_vufind(service: str, full: bool = False) -> AsyncIterator[str] | str:
+    '''
+    Get ths logs for a service
+    Args:
+        service (str): Name of the service to get the logs for
+        full (bool): Show all the files, instead of pages loaded on demand
+    Returns:
+        (AsyncIterator|str): Page with the logs from all of the nodes; with full, streamed
+            as they are received, one node after the other
+    '''
+    if not full:
+        return await quart.render_template(
+            'logs.html',
+            service=service, logs=None, stack_name=os.getenv('STACK_NAME')
+        )
+    return await quart.stream_template(
         'logs.html',
-        service=service, log1=logs[0], log2=logs[1],
-        log3=logs[2], stack_name=os.getenv('STACK_NAME')
+        service=service, logs=[_node_log_chunks(node, service) for node in range(1, 4)],
+        stack_name=os.getenv('STACK_NAME')
     )
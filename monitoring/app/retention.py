@@ -0,0 +1,147 @@
+'''Retention policy for the collected data'''
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import mariadb as db
+
+import rollup # pylint: disable=import-error
+from util import DBConnection # pylint: disable=import-error
+
+
+def _retention_days(name: str, default: int | None) -> int | None:
+    # An empty value or 0 means the data is kept forever
+    value = os.getenv(name)
+    if value is None:
+        return default
+    if value.strip() in ('', '0'):
+        return None
+    return int(value)
+
+# Number of days to keep each resolution of data (None: forever)
+RETENTION_DAYS = {
+    'raw': _retention_days('RETENTION_RAW_DAYS', 14),
+    'hourly': _retention_days('RETENTION_HOURLY_DAYS', 730),
+    'daily': _retention_days('RETENTION_DAILY_DAYS', None),
+    'monthly': _retention_days('RETENTION_MONTHLY_DAYS', None),
+}
+# Tables for each resolution
+TABLES = {
+    'raw': ['data', 'route_data', 'container_data'],
+    'hourly': ['data_hourly', 'route_data_hourly'],
+    'daily': ['data_daily', 'route_data_daily'],
+    'monthly': ['data_monthly', 'route_data_monthly'],
+}
+# Second column of the primary key (node, column, time) of the tables without a (node, time)
+# index: their rows are deleted for each value of the column, so that the deletes use the
+# primary key instead of scanning all the rows of the node
+KEY_COLUMNS = {
+    'route_data': 'route',
+    'data_hourly': 'variable',
+    'route_data_hourly': 'route',
+    'data_daily': 'variable',
+    'route_data_daily': 'route',
+    'data_monthly': 'variable',
+    'route_data_monthly': 'route',
+}
+# Resolution each one is rolled up into: rows are only deleted once they have been rolled up
+ROLLED_UP_INTO = {
+    'raw': 'hourly',
+    'hourly': 'daily',
+    'daily': 'monthly',
+    'monthly': None,
+}
+# Small batches with a pause in between, to avoid triggering Galera flow control
+BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '0.2'))
+
+_last_report = {}
+
+
+def _cutoff(resolution: str, now: datetime) -> datetime | None:
+    days = RETENTION_DAYS[resolution]
+    if days is None:
+        return None
+    cutoff = now - timedelta(days=days)
+    rolled_up_into = ROLLED_UP_INTO[resolution]
+    if rolled_up_into is not None:
+        progress = rollup.rollup_progress(rolled_up_into)
+        if progress is None:
+            # Nothing is known to be rolled up yet
+            return None
+        cutoff = min(cutoff, progress)
+    return cutoff
+
+def _delete_batches(conn, table: str, condition: str, params: tuple) -> int:
+    cur = conn.cursor()
+    removed = 0
+    while True:
+        cur.execute(
+            f'DELETE FROM {table} WHERE {condition} ORDER BY time LIMIT {BATCH_SIZE}', params
+        )
+        conn.commit()
+        removed += cur.rowcount
+        if cur.rowcount < BATCH_SIZE:
+            return removed
+        time.sleep(BATCH_PAUSE)
+
+def _delete_older_than(conn, table: str, node: int, cutoff: datetime) -> int:
+    column = KEY_COLUMNS.get(table)
+    if column is None:
+        return _delete_batches(conn, table, 'node = %s AND time < %s', (node, cutoff))
+    cur = conn.cursor()
+    cur.execute(f'SELECT DISTINCT {column} FROM {table} WHERE node = %s', (node,))
+    values = [row[0] for row in cur.fetchall()]
+    removed = 0
+    for value in values:
+        removed += _delete_batches(
+            conn, table, f'node = %s AND {column} = %s AND time < %s', (node, value, cutoff)
+        )
+    return removed
+
+def apply(now: datetime | None = None) -> dict[str, int]:
+    '''
+    Delete the rows of this node which are older than the retention period of their table
+    Args:
+        now (datetime): Current time
+    Returns:
+        (dict): Number of rows removed for each table
+    '''
+    if now is None:
+        now = datetime.now()
+    node = int(os.getenv('NODE'))
+    removed = {}
+    with DBConnection() as conn:
+        for resolution, tables in TABLES.items():
+            cutoff = _cutoff(resolution, now)
+            if cutoff is None:
+                continue
+            for table in tables:
+                removed[table] = _delete_older_than(conn, table, node, cutoff)
+    return removed
+
+def last_report() -> dict:
+    '''
+    Get the report of the last retention run on this node
+    Returns:
+        (dict): Time of the run, and number of rows removed for each table (or the error)
+    '''
+    return _last_report
+
+def main():
+    '''
+    Apply the retention policy, called regularly by the scheduler
+    '''
+    run_time = datetime.now()
+    report = {'time': run_time.strftime('%Y-%m-%d %H:%M:%S')}
+    try:
+        removed = apply(run_time)
+        report['removed'] = removed
+        report['total'] = sum(removed.values())
+        details = ', '.join(f'{table}: {count}' for table, count in removed.items())
+        print(f"Retention policy: removed {report['total']} rows ({details})")
+    except db.Error as err:
+        report['error'] = str(err)
+        print(f"Error applying the retention policy: {err}", file=sys.stderr)
+    _last_report.clear()
+    _last_report.update(report)
@@ -0,0 +1,211 @@
+'''Rollup of the collected data into hourly, daily and monthly tables'''
+import os
+import sys
+from datetime import datetime, timedelta
+import mariadb as db
+
+from histogram import Histogram # pylint: disable=import-error
+from util import DBConnection # pylint: disable=import-error
+
+
+# Numeric columns of the data table which are rolled up
+DATA_VARIABLES = [
+    'available_memory', 'available_disk_space', 'apache_requests', 'response_time',
+    'response_time_p50', 'response_time_p90', 'response_time_p99', 'response_time_max',
+    'solr_solr_cpu', 'solr_solr_mem', 'solr_cron_cpu', 'solr_cron_mem', 'solr_zk_cpu',
+    'solr_zk_mem', 'catalog_catalog_cpu', 'catalog_catalog_mem', 'mariadb_galera_cpu',
+    'mariadb_galera_mem', 'load_average', 'cpu_pressure', 'memory_pressure', 'io_pressure',
+    'disk_read_rate', 'disk_write_rate'
+]
+# Resolutions, from the finest to the coarsest, with the resolution they are computed from
+RESOLUTIONS = ['hourly', 'daily', 'monthly']
+SOURCES = {
+    'hourly': None,
+    'daily': 'hourly',
+    'monthly': 'daily',
+}
+# SQL expressions for the start of the bucket containing `time`
+SQL_BUCKETS = {
+    'hourly': 'TIMESTAMP(DATE(time), MAKETIME(HOUR(time), 0, 0))',
+    'daily': 'TIMESTAMP(DATE(time))',
+    'monthly': 'TIMESTAMP(DATE(time) - INTERVAL (DAYOFMONTH(time) - 1) DAY)',
+}
+# Maximum number of chunks processed per run, so that a backfill is done progressively
+MAX_CHUNKS_PER_RUN = 31
+
+# Start of the last bucket rolled up for each table, read from the database at the first run
+_progress: dict[str, datetime | None] = {}
+
+
+def bucket_start(time: datetime, resolution: str) -> datetime:
+    '''
+    Get the start of the bucket containing a given time
+    Args:
+        time (datetime): Time within the bucket
+        resolution (str): One of RESOLUTIONS
+    Returns:
+        (datetime): Start of the bucket
+    '''
+    if resolution == 'hourly':
+        return time.replace(minute=0, second=0, microsecond=0)
+    if resolution == 'daily':
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _chunk_end(start: datetime, resolution: str) -> datetime:
+    # Chunks are aligned on the buckets: a day of hours, a month of days, a year of months
+    if resolution == 'hourly':
+        return bucket_start(start, 'daily') + timedelta(days=1)
+    if resolution == 'daily':
+        return (bucket_start(start, 'monthly') + timedelta(days=32)).replace(day=1)
+    return start.replace(year=start.year + 1, month=1, day=1)
+
+def _data_source_query(resolution: str) -> str:
+    bucket = SQL_BUCKETS[resolution]
+    source = SOURCES[resolution]
+    if source is None:
+        selects = [
+            f'SELECT node, {bucket} AS bucket, "{variable}" AS variable, MIN({variable}), ' \
+            f'MAX({variable}), AVG({variable}), COUNT({variable}) FROM data ' \
+            'WHERE node = %s AND time >= %s AND time < %s ' \
+            f'GROUP BY node, bucket HAVING COUNT({variable}) > 0'
+            for variable in DATA_VARIABLES
+        ]
+        return ' UNION ALL '.join(selects)
+    return f'SELECT node, {bucket} AS bucket, variable, MIN(min_value), MAX(max_value), ' \
+        'SUM(avg_value * sample_count) / SUM(sample_count), SUM(sample_count) ' \
+        f'FROM data_{source} WHERE node = %s AND time >= %s AND time < %s ' \
+        'GROUP BY node, bucket, variable'
+
+def _rollup_data(cur, resolution: str, node: int, start: datetime, end: datetime):
+    statement = f'INSERT INTO data_{resolution} (node, time, variable, min_value, ' \
+        'max_value, avg_value, sample_count) ' \
+        f'SELECT * FROM ({_data_source_query(resolution)}) AS source ' \
+        'ON DUPLICATE KEY UPDATE min_value = VALUES(min_value), ' \
+        'max_value = VALUES(max_value), avg_value = VALUES(avg_value), ' \
+        'sample_count = VALUES(sample_count)'
+    if SOURCES[resolution] is None:
+        params = (node, start, end) * len(DATA_VARIABLES)
+    else:
+        params = (node, start, end)
+    cur.execute(statement, params)
+
+def _merge_route_rows(cur, resolution: str, node: int) -> list[tuple]:
+    buckets = {}
+    for (time, route, count, bytes_sent, response_time, time_max, histogram, samples) in cur:
+        key = (bucket_start(time, resolution), route)
+        if key not in buckets:
+            buckets[key] = {
+                'request_count': 0, 'bytes_sent': 0, 'response_time_total': 0,
+                'histogram': Histogram(), 'sample_count': 0,
+            }
+        bucket = buckets[key]
+        bucket['request_count'] += count
+        bucket['bytes_sent'] += bytes_sent
+        if response_time is not None:
+            bucket['response_time_total'] += response_time * count
+        bucket['histogram'].merge(Histogram.decode(histogram, time_max))
+        bucket['sample_count'] += samples
+    return [
+        (node, time, route, bucket['request_count'], bucket['bytes_sent'],
+            None if bucket['request_count'] == 0 else
+                bucket['response_time_total'] // bucket['request_count'],
+            bucket['histogram'].max, bucket['histogram'].encode(), bucket['sample_count'])
+        for (time, route), bucket in buckets.items()
+    ]
+
+def _rollup_routes(cur, resolution: str, node: int, start: datetime, end: datetime):
+    # Histograms are merged here, so the route rows are grouped in Python
+    source = SOURCES[resolution]
+    if source is None:
+        cur.execute(
+            'SELECT time, route, request_count, bytes_sent, response_time, ' \
+            'response_time_max, histogram, 1 FROM route_data ' \
+            'WHERE node = %s AND time >= %s AND time < %s',
+            (node, start, end)
+        )
+    else:
+        cur.execute(
+            'SELECT time, route, request_count, bytes_sent, response_time, ' \
+            f'response_time_max, histogram, sample_count FROM route_data_{source} ' \
+            'WHERE node = %s AND time >= %s AND time < %s',
+            (node, start, end)
+        )
+    rows = _merge_route_rows(cur, resolution, node)
+    if rows:
+        cur.executemany(
+            f'INSERT INTO route_data_{resolution} (node, time, route, request_count, ' \
+            'bytes_sent, response_time, response_time_max, histogram, sample_count) ' \
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ' \
+            'ON DUPLICATE KEY UPDATE request_count = VALUES(request_count), ' \
+            'bytes_sent = VALUES(bytes_sent), response_time = VALUES(response_time), ' \
+            'response_time_max = VALUES(response_time_max), histogram = VALUES(histogram), ' \
+            'sample_count = VALUES(sample_count)',
+            rows
+        )
+
+def _initial_progress(cur, resolution: str, node: int) -> datetime | None:
+    # Continue from the last bucket rolled up, or start from the oldest data to backfill
+    cur.execute(f'SELECT MAX(time) FROM data_{resolution} WHERE node = %s', (node,))
+    last = cur.fetchone()[0]
+    if last is not None:
+        return last
+    source = SOURCES[resolution]
+    source_table = 'data' if source is None else f'data_{source}'
+    cur.execute(f'SELECT MIN(time) FROM {source_table} WHERE node = %s', (node,))
+    oldest = cur.fetchone()[0]
+    return None if oldest is None else bucket_start(oldest, resolution)
+
+def rollup_progress(resolution: str) -> datetime | None:
+    '''
+    Get how far a resolution has been rolled up by this process
+    Args:
+        resolution (str): One of RESOLUTIONS
+    Returns:
+        (datetime|None): Start of the last bucket, which may still change; all the data
+            before it has been rolled up. None if unknown.
+    '''
+    return _progress.get(resolution)
+
+def update(now: datetime | None = None):
+    '''
+    Roll up the data collected on this node since the last update, from the finest
+    resolution to the coarsest. The last bucket of each table is computed again,
+    as it may have been incomplete. A resolution is never rolled up further than
+    the one it is computed from.
+    Args:
+        now (datetime): Current time
+    '''
+    if now is None:
+        now = datetime.now()
+    node = int(os.getenv('NODE'))
+    with DBConnection() as conn:
+        cur = conn.cursor()
+        for resolution in RESOLUTIONS:
+            if _progress.get(resolution) is None:
+                _progress[resolution] = _initial_progress(cur, resolution, node)
+            start = _progress[resolution]
+            source = SOURCES[resolution]
+            limit = now if source is None else _progress[source]
+            if start is None or limit is None:
+                continue
+            start = bucket_start(start, resolution)
+            for _ in range(MAX_CHUNKS_PER_RUN):
+                end = _chunk_end(start, resolution)
+                _rollup_data(cur, resolution, node, start, end)
+                _rollup_routes(cur, resolution, node, start, end)
+                conn.commit()
+                if end > limit:
+                    _progress[resolution] = bucket_start(limit, resolution)
+                    break
+                _progress[resolution] = bucket_start(end - timedelta(seconds=1), resolution)
+                start = end
+
+def main():
+    '''
+    Update the rollup tables, called regularly by the scheduler
+    '''
+    try:
+        update()
+    except db.Error as err:
+        print(f"Error updating the rollup tables: {err}", file=sys.stderr)
@@ -0,0 +1,122 @@
+// Pages of the log files of each node, loaded on demand from the older and newer cursors
+
+function logPageUrl(pages, cursor, direction) {
+    var params = new URLSearchParams({ direction: direction });
+    if (cursor) {
+        params.set('file', cursor.file);
+        if (cursor.offset !== null)
+            params.set('offset', cursor.offset);
+    }
+    return '/monitoring/log_page/' + pages.dataset.node + '/' + pages.dataset.service + '?' +
+        params.toString();
+}
+
+function addLogText(pages, page, direction) {
+    // Text of each file, from the oldest to the newest
+    var sections = pages.sections;
+    if (direction == 'older') {
+        if (sections.length > 0 && sections[0].file == page.file)
+            sections[0].text = page.text + sections[0].text;
+        else
+            sections.unshift({ file: page.file, text: page.text });
+    } else {
+        var last = sections[sections.length - 1];
+        if (last && last.file == page.file)
+            last.text += page.text;
+        else
+            sections.push({ file: page.file, text: page.text });
+    }
+    pages.querySelector('.log-text').textContent = sections.map(function (section) {
+        return section.file + ':\n' + section.text;
+    }).join('\n---------------------------\n\n');
+}
+
+async function loadLogPage(pages, direction) {
+    var first = pages.sections === undefined;
+    var error = pages.querySelector('.log-error');
+    error.textContent = '';
+    var page;
+    try {
+        var response = await fetch(logPageUrl(pages, direction == 'older' ? pages.older : pages.newer,
+            direction));
+        page = await response.json();
+    } catch (err) {
+        error.textContent = 'Error loading the log: ' + err;
+        return;
+    }
+    if (page.error) {
+        error.textContent = page.error;
+        return;
+    }
+    if (first)
+        pages.sections = [];
+    addLogText(pages, page, direction);
+    if (first || direction == 'older')
+        pages.older = page.older;
+    if (first || direction == 'newer')
+        pages.newer = page.newer;
+    pages.querySelector('.log-older').disabled = !pages.older;
+}
+
+// Live tail of the logs of all the nodes, with the lines interleaved as they arrive
+
+var MAX_TAIL_LINES = 5000;
+
+function appendTailLine(tail, text) {
+    var pre = tail.querySelector('.log-tail-text');
+    var atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 10;
+    pre.appendChild(document.createTextNode(text + '\n'));
+    while (pre.childNodes.length > MAX_TAIL_LINES)
+        pre.removeChild(pre.firstChild);
+    if (atBottom)
+        window.scrollTo(0, document.body.scrollHeight);
+}
+
+function startTail(tail) {
+    var source = new EventSource('/monitoring/logs/' + tail.dataset.service + '/tail');
+    var status = tail.querySelector('.log-tail-status');
+    source.onopen = function () {
+        status.textContent = 'Following';
+    };
+    source.onerror = function () {
+        status.textContent = 'Disconnected, reconnecting...';
+    };
+    source.onmessage = function (message) {
+        var data = JSON.parse(message.data);
+        if (data.event == 'rotate')
+            appendTailLine(tail, '[node ' + data.node + '] --- ' + data.line + ' was rotated ---');
+        else
+            appendTailLine(tail, '[node ' + data.node + '] ' + data.line);
+    };
+    tail.source = source;
+    tail.querySelector('.log-tail-start').disabled = true;
+    tail.querySelector('.log-tail-stop').disabled = false;
+}
+
+function stopTail(tail) {
+    tail.source.close();
+    tail.querySelector('.log-tail-status').textContent = 'Stopped';
+    tail.querySelector('.log-tail-start').disabled = false;
+    tail.querySelector('.log-tail-stop').disabled = true;
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('.log-tail').forEach(function (tail) {
+        tail.querySelector('.log-tail-start').addEventListener('click', function () {
+            startTail(tail);
+        });
+        tail.querySelector('.log-tail-stop').addEventListener('click', function () {
+            stopTail(tail);
+        });
+    });
+    document.querySelectorAll('.log-pages').forEach(function (pages) {
+        pages.querySelector('.log-older').addEventListener('click', function () {
+            loadLogPage(pages, 'older');
+        });
+        pages.querySelector('.log-newer').addEventListener('click', function () {
+            loadLogPage(pages, 'newer');
+        });
+        // Last page of the current log file
+        loadLogPage(pages, 'older');
+    });
+});
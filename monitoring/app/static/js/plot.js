@@ -1,25 +1,95 @@
-function plot(variable, period, data) {
+function ytitle(variable, route) {
     var variable_with_spaces = variable.replaceAll('_', ' ')
-    var ytitle;
     if (variable == 'apache_requests')
-        ytitle = 'Apache average hits / minute';
-    else if (variable == 'response_time')
-        ytitle = 'Average VuFind search response time (ms)';
-    else if (variable.endsWith('_cpu'))
-        ytitle = 'Average ' + variable_with_spaces + ' (%)';
-    else if (variable.endsWith('_mem'))
-        ytitle = 'Maximum ' + variable_with_spaces + ' (%)';
-    else
-        ytitle = 'Minimum ' + variable_with_spaces + ' (%)';
+        return 'Apache average hits / minute';
+    if (variable == 'response_time')
+        return 'Average VuFind search response time (ms)';
+    if (variable == 'route_requests')
+        return 'Average ' + route + ' hits / minute';
+    if (variable == 'route_bytes_sent')
+        return 'Average ' + route + ' bytes sent / minute';
+    if (variable == 'route_response_time')
+        return 'Average ' + route + ' response time (ms)';
+    if (variable == 'response_time_max')
+        return 'Maximum VuFind ' + route + ' response time (ms)';
+    if (variable.startsWith('response_time_p'))
+        return variable.slice(-3) + ' VuFind ' + route + ' response time (ms)';
+    if (variable == 'load_average')
+        return 'Average load (1 minute)';
+    if (variable.endsWith('_pressure'))
+        return 'Average time some tasks were stalled on ' + variable.split('_')[0] + ' (%)';
+    if (variable == 'disk_read_rate')
+        return 'Average disk reads (bytes / s)';
+    if (variable == 'disk_write_rate')
+        return 'Average disk writes (bytes / s)';
+    if (variable.endsWith('_cpu'))
+        return 'Average ' + variable_with_spaces + ' (%)';
+    if (variable.endsWith('_mem'))
+        return 'Maximum ' + variable_with_spaces + ' (%)';
+    return 'Minimum ' + variable_with_spaces + ' (%)';
+}
+
+function plot(variable, period_label, data, route, points) {
+    var variable_with_spaces = variable.replaceAll('_', ' ')
     var title = variable_with_spaces.charAt(0).toUpperCase() + variable_with_spaces.slice(1) +
-        ' for the last ' + period;
+        (route ? ' (' + route + ')' : '') + ' ' + period_label;
     var layout = { 
         title: title,
         font: { size: 16 },
         yaxis: {
-            title: ytitle
+            title: ytitle(variable, route)
         }
     };
     var config = { responsive: true };
     Plotly.newPlot('plot', data, layout, config);
+    // Zooming loads the data for the selected window, at a finer resolution
+    document.getElementById('plot').on('plotly_relayout', function(event) {
+        if (!event['xaxis.range[0]'] || !event['xaxis.range[1]'])
+            return;
+        var params = new URLSearchParams({
+            start: event['xaxis.range[0]'].substring(0, 19).replace(' ', 'T'),
+            end: event['xaxis.range[1]'].substring(0, 19).replace(' ', 'T'),
+        });
+        if (route)
+            params.set('route', route);
+        if (points)
+            params.set('points', points);
+        window.location = '/monitoring/graphs/' + variable + '/custom?' + params.toString();
+    });
+}
+
+// Columnar data from /monitoring/graph_data: one small graph for each variable,
+// with a trace for each node
+function dashboard(element_id, period_label, data, route) {
+    var container = document.getElementById(element_id);
+    var traces = {};
+    data.series.forEach(function(series) {
+        if (!(series.variable in traces))
+            traces[series.variable] = [];
+        traces[series.variable].push({
+            name: 'node ' + series.node,
+            type: 'scatter',
+            x: data.timestamps,
+            y: series.values,
+        });
+    });
+    for (var variable in traces) {
+        var div = document.createElement('div');
+        div.className = 'col-6';
+        container.appendChild(div);
+        var variable_with_spaces = variable.replaceAll('_', ' ');
+        var link = '/monitoring/graphs/' + variable + '/' + window.location.pathname.split('/').pop() +
+            window.location.search;
+        var layout = {
+            title: '<a href="' + link + '">' + variable_with_spaces.charAt(0).toUpperCase() +
+                variable_with_spaces.slice(1) + '</a>',
+            font: { size: 12 },
+            height: 300,
+            margin: { t: 40, b: 40 },
+            yaxis: {
+                title: ytitle(variable, route)
+            }
+        };
+        Plotly.newPlot(div, traces[variable], layout, { responsive: true });
+    }
 }
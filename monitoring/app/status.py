@@ -7,24 +7,26 @@ import re
 from aiohttp import ClientError, ClientSession
 import humanize
 
-from util import ExecException, async_exec, multiple_get, async_single_get, get_aiohttp_session # pylint: disable=import-error
+import containers # pylint: disable=import-error
+import retention # pylint: disable=import-error
+import sysmetrics # pylint: disable=import-error
+from galera import node_galera_status # pylint: disable=import-error
+from util import multiple_get, async_single_get, get_aiohttp_session, run_async, db_pool_stats, http_client_stats, TTLCache # pylint: disable=import-error,line-too-long
+
+# Status results are reused for this many seconds, and then served while being updated
+# for up to STATUS_CACHE_MAX_STALE more seconds
+STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', '10'))
+STATUS_CACHE_MAX_STALE = float(os.getenv('STATUS_CACHE_MAX_STALE', '60'))
+# Interval between the node probes run by the scheduler, in seconds
+STATUS_PROBE_INTERVAL = float(os.getenv('STATUS_PROBE_INTERVAL', '30'))
 
 
 # Galera
 
-async def _node_cluster_state_uuid() -> str:
-    try:
-        with open(os.getenv('MARIADB_VUFIND_PASSWORD_FILE'), 'r', encoding='UTF-8') as f:
-            password = f.read().strip()
-            f.close()
-        return await async_exec("mariadb", "--skip_ssl", "-h", "galera", "-u", "vufind",
-            f"-p{password}", "-ss", "-e",
-            "SELECT variable_value from information_schema.global_status WHERE " \
-            "variable_name='wsrep_cluster_state_uuid';")
-    except ExecException as ex:
-        return f"Error getting the cluster state uuid: {ex}"
-    except asyncio.TimeoutError:
-        return "Timeout getting the cluster state uuid"
+# Local state of a node while it is the donor of a state transfer, for instance during
+# a backup: it is expected, and only reported as a warning
+GALERA_DONOR_STATE = 'Donor/Desynced'
+
 
 def _check_cluster_state_uuid(statuses: list[dict]) -> bool:
     uuid0 = statuses[0]['cluster_state_uuid']
@@ -32,32 +34,56 @@ def _check_cluster_state_uuid(statuses: list[dict]) -> bool:
     uuid2 = statuses[2]['cluster_state_uuid']
     return uuid0 == uuid1 and uuid0 == uuid2
 
-async def get_galera_status(statuses: list[dict]) -> str:
+def get_galera_status(statuses: list[dict]) -> str:
     '''
     Get the current status from Galera
     Args:
         statuses (list): Status data
     Returns:
-        (str):  Error message or 'OK'
+        (str):  Error message, warning message or 'OK'
     '''
-    try:
-        with open(os.getenv('MARIADB_VUFIND_PASSWORD_FILE'), 'r', encoding='UTF-8') as f:
-            password = f.read().strip()
-            f.close()
-        cluster_size = await async_exec("mariadb", "--skip_ssl", "-h", "galera", "-u", "vufind",
-            f"-p{password}", "-ss", "-e",
-            "SELECT variable_value from information_schema.global_status " \
-            "WHERE variable_name='wsrep_cluster_size';")
-        del password
-    except ExecException as ex:
-        return f"Error checking the galera status: {ex}"
-    except asyncio.TimeoutError:
-        return "Timeout when checking the galera status"
-    if cluster_size != '3':
-        return f'Error: wrong cluster size: {cluster_size}'
+    warning = None
+    for node in range(1, 4):
+        galera = statuses[node-1].get('galera')
+        if not isinstance(galera, dict):
+            return f'Error on node {node}: {galera}'
+        if galera['wsrep_cluster_size'] != 3:
+            return f"Error: wrong cluster size: {galera['wsrep_cluster_size']}"
+        state = galera['wsrep_local_state_comment']
+        if state == GALERA_DONOR_STATE:
+            warning = f'Warning on node {node}: state is {state} (state transfer or backup)'
+        elif state != 'Synced':
+            return f"Error on node {node}: state is {state}"
     if not _check_cluster_state_uuid(statuses):
         return 'Error: different cluster state uuids'
-    return 'OK'
+    return warning or 'OK'
+
+def get_galera_details(statuses: list[dict]) -> list[dict | None]:
+    '''
+    Get replication figures for each Galera node
+    Args:
+        statuses (list): Status data
+    Returns:
+        (list): For each node, the state, the current and average receive queue, and the
+            percentage of time paused by flow control (None if the status is not available).
+            These are figures of each node: the nodes are probed at different times, so
+            their values can not be compared with each other.
+    '''
+    galeras = [node_status.get('galera') for node_status in statuses]
+    details = []
+    for galera in galeras:
+        if not isinstance(galera, dict):
+            details.append(None)
+            continue
+        paused = galera['wsrep_flow_control_paused']
+        details.append({
+            'state': galera['wsrep_local_state_comment'],
+            'recv_queue': galera['wsrep_local_recv_queue'],
+            'recv_queue_avg': galera['wsrep_local_recv_queue_avg'],
+            'flow_control_paused': None if paused is None else round(paused * 100, 2),
+            'flow_control_sent': galera['wsrep_flow_control_sent'],
+        })
+    return details
 
 
 # Solr
@@ -252,33 +278,27 @@ def get_vufind_status(statuses: list[dict]) -> str:
 
 # Available memory and disk space
 
-async def node_available_memory() -> str:
+def node_available_memory() -> float | str:
     '''
     Get the memory available on the current node
     Returns:
-        (str): Amount of memory available, or the error retrieving it
+        (float|str): Percentage of memory available, or the error retrieving it
     '''
     try:
-        return await async_exec("/bin/sh", "-c", "free | grep Mem | awk '{print $7/$2 * 100.0}'")
-    except ExecException as ex:
-        return f"Error getting available memory: {ex}"
-    except asyncio.TimeoutError:
-        return "Timeout when getting available memory"
+        return sysmetrics.available_memory()
+    except (OSError, KeyError, ValueError, ZeroDivisionError) as err:
+        return f"Error getting available memory: {err}"
 
-async def node_available_disk_space() -> str:
+def node_available_disk_space() -> float | str:
     '''
     Get the disk space available on the current node
     Returns:
-        (str): Amount of disk space available, or the error retrieving it
+        (float|str): Percentage of disk space available, or the error retrieving it
     '''
     try:
-        return await async_exec(
-            "/bin/sh", "-c", "df / | grep overlay | awk '{print $4/$2 * 100.0}'"
-        )
-    except ExecException as ex:
-        return f"Error getting available disk space: {ex}"
-    except asyncio.TimeoutError:
-        return "Timeout when getting available disk space"
+        return sysmetrics.available_disk_space('/')
+    except (OSError, ZeroDivisionError) as err:
+        return f"Error getting available disk space: {err}"
 
 def get_memory_status(statuses: list[dict]) -> str:
     '''
@@ -425,38 +445,33 @@ def get_cron_status(name: str, statuses: list[dict]) -> str:
 
 # Getting all the node statuses at once
 
-def get_node_status() -> dict:
-    '''
-    Get the status for the current node
-    Returns:
-        (dict): Data with the service status on the current node
-    '''
+def _probe_node_status() -> dict:
     async def async_inner():
         async with get_aiohttp_session() as aiohttp_session:
             commands = [
-                _node_cluster_state_uuid(),
+                node_galera_status(),
                 _node_solr_status(aiohttp_session),
                 _node_vufind_status(aiohttp_session),
-                node_available_memory(),
-                node_available_disk_space()
             ]
             return await asyncio.gather(*commands)
-    results = asyncio.run(async_inner())
+    results = run_async(async_inner())
     status = {}
-    status['cluster_state_uuid'] = results[0]
+    status['galera'] = results[0]
+    status['cluster_state_uuid'] = results[0]['wsrep_cluster_state_uuid'] \
+        if isinstance(results[0], dict) else results[0]
     status['solr'] = results[1]
     status['vufind'] = results[2]
-    status['available_memory'] = results[3]
-    status['available_disk_space'] = results[4]
+    status['available_memory'] = node_available_memory()
+    status['available_disk_space'] = node_available_disk_space()
     status['harvests'] = _node_cron_exit_codes()
+    status['db_pool'] = db_pool_stats()
+    status['retention'] = retention.last_report()
+    status['containers'] = containers.last_report()
+    status['http_client'] = http_client_stats()
+    status['time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     return status
 
-def get_node_statuses() -> list[dict] | str:
-    '''
-    Get the status of each monitoting node
-    Returns:
-        (list|str): The status from each node or the error message
-    '''
+def _fetch_node_statuses() -> list[dict] | str:
     urls = []
     for node in range(1, 4):
         urls.append(f'http://monitoring{node}/monitoring/node/status')
@@ -467,3 +482,32 @@ def get_node_statuses() -> list[dict] | str:
     except asyncio.TimeoutError:
         return 'Timeout when reading node status'
     return statuses
+
+# The node status is normally updated by the scheduler (see probe_node_status), and only
+# probed on request if the scheduler is late or not running
+_node_status_cache = TTLCache(
+    _probe_node_status, 2 * STATUS_PROBE_INTERVAL, STATUS_CACHE_MAX_STALE
+)
+_node_statuses_cache = TTLCache(_fetch_node_statuses, STATUS_CACHE_TTL, STATUS_CACHE_MAX_STALE)
+
+def probe_node_status():
+    '''
+    Probe the services on this node and keep the result, called regularly by the scheduler
+    '''
+    _node_status_cache.update()
+
+def get_node_status() -> dict:
+    '''
+    Get the latest status for the current node, with the time it was checked
+    Returns:
+        (dict): Data with the service status on the current node
+    '''
+    return _node_status_cache.get()[0]
+
+def get_node_statuses() -> tuple[list[dict] | str, float]:
+    '''
+    Get the status of each monitoting node, fetched at most once every STATUS_CACHE_TTL seconds
+    Returns:
+        (tuple): The status from each node or the error message, and its age in seconds
+    '''
+    return _node_statuses_cache.get()
@@ -0,0 +1,110 @@
+'''System metrics, read directly from /proc and the file system'''
+import os
+import time
+
+
+# Sectors in /proc/diskstats are always 512 bytes
+SECTOR_SIZE = 512
+# Block devices which are not physical disks, or are built on other disks
+VIRTUAL_DISK_PREFIXES = ('loop', 'ram', 'zram', 'dm-', 'md', 'sr', 'nbd')
+PRESSURE_RESOURCES = ['cpu', 'memory', 'io']
+
+
+def available_memory() -> float:
+    '''
+    Get the memory available on the node
+    Returns:
+        (float): Available memory, in percent of the total memory
+    '''
+    meminfo = {}
+    with open('/proc/meminfo', 'r', encoding='UTF-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                meminfo[parts[0].rstrip(':')] = int(parts[1])
+    return meminfo['MemAvailable'] / meminfo['MemTotal'] * 100.
+
+def available_disk_space(path: str = '/') -> float:
+    '''
+    Get the disk space available to unprivileged users on a file system
+    Args:
+        path (str): Any path on the file system
+    Returns:
+        (float): Available disk space, in percent of the size of the file system
+    '''
+    stat = os.statvfs(path)
+    return stat.f_bavail / stat.f_blocks * 100.
+
+def load_average() -> tuple[float, float, float]:
+    '''
+    Get the load average of the node
+    Returns:
+        (tuple): Load average over 1, 5 and 15 minutes
+    '''
+    with open('/proc/loadavg', 'r', encoding='UTF-8') as f:
+        parts = f.read().split()
+    return (float(parts[0]), float(parts[1]), float(parts[2]))
+
+def pressure(resource: str) -> dict[str, float] | None:
+    '''
+    Get the pressure stall information (PSI) for a resource
+    Args:
+        resource (str): One of PRESSURE_RESOURCES
+    Returns:
+        (dict|None): Percentage of time some or all tasks were stalled, averaged over 10, 60
+            and 300 seconds, with keys like 'some_avg60'; None if PSI is not available
+    '''
+    try:
+        with open(f'/proc/pressure/{resource}', 'r', encoding='UTF-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        kind, *fields = line.split()
+        for field in fields:
+            name, value = field.split('=')
+            if name.startswith('avg'):
+                values[f'{kind}_{name}'] = float(value)
+    return values
+
+
+class DiskStats(): # pylint: disable=too-few-public-methods
+    '''
+    Read and write rates of the physical disks, computed from the /proc/diskstats
+    counters between two updates
+    '''
+    def __init__(self):
+        self._previous = None
+
+    @staticmethod
+    def _is_physical_disk(name: str) -> bool:
+        return os.path.exists(f'/sys/block/{name}') and not name.startswith(VIRTUAL_DISK_PREFIXES)
+
+    def _read_counters(self) -> tuple[int, int]:
+        sectors_read = 0
+        sectors_written = 0
+        with open('/proc/diskstats', 'r', encoding='UTF-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 10 and self._is_physical_disk(parts[2]):
+                    sectors_read += int(parts[5])
+                    sectors_written += int(parts[9])
+        return (sectors_read * SECTOR_SIZE, sectors_written * SECTOR_SIZE)
+
+    def update(self) -> tuple[float, float] | tuple[None, None]:
+        '''
+        Read the counters and compute the rates since the previous update
+        Returns:
+            (tuple): Bytes read and written per second, or None for the first update
+                (or after a counter reset)
+        '''
+        now = time.monotonic()
+        (bytes_read, bytes_written) = self._read_counters()
+        previous = self._previous
+        self._previous = (now, bytes_read, bytes_written)
+        if previous is None or now <= previous[0] or bytes_read < previous[1] \
+                or bytes_written < previous[2]:
+            return (None, None)
+        elapsed = now - previous[0]
+        return ((bytes_read - previous[1]) / elapsed, (bytes_written - previous[2]) / elapsed)
@@ -1,14 +1,21 @@
 '''General utilities'''
+import atexit
 import os
 from contextlib import asynccontextmanager
 import json
 import asyncio
+import threading
+import time
 import aiohttp
 import mariadb as db
 
 
 MAX_PARALLEL_REQUESTS = 100
 DEFAULT_TIMEOUT = 10
+STREAM_CHUNK_SIZE = 64*1024
+DB_POOL_SIZE = int(os.getenv('MONITORING_DB_POOL_SIZE', '5'))
+# Connections idle for longer than this (in seconds) are checked before being used
+DB_VALIDATION_INTERVAL = 5
 
 
 class ExecException(Exception):
@@ -45,54 +52,185 @@ async def async_exec(program: str, *args, timeout: int=DEFAULT_TIMEOUT) -> str:
     return stdout.decode().strip()
 
 
-def get_eventloop() -> asyncio.events.AbstractEventLoop:
+class BackgroundLoop():
     '''
-    Get the asyncio eventloop required to run aysnc requests
+    Event loop running in a daemon thread, shared by all the threads of the process.
+    It owns a persistent aiohttp session, so that connections to the other hosts are
+    kept alive and reused between requests, and keeps connection metrics for each host.
+    '''
+    def __init__(self):
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+        self._host_stats = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name='background-loop', daemon=True
+                ).start()
+            return self._loop
+
+    def run(self, coroutine):
+        '''
+        Run a coroutine on the loop and wait for its result, from a synchronous thread
+        Args:
+            coroutine (coroutine): Coroutine to run
+        Returns:
+            (any): Result of the coroutine (its exceptions are raised again)
+        '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    async def run_async(self, coroutine):
+        '''
+        Run a coroutine on the loop and await its result, from another event loop
+        Args:
+            coroutine (coroutine): Coroutine to run
+        Returns:
+            (any): Result of the coroutine (its exceptions are raised again)
+        '''
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+        )
+
+    def _host(self, host: str) -> dict:
+        if host not in self._host_stats:
+            self._host_stats[host] = {
+                'requests': 0, 'errors': 0, 'new_connections': 0, 'reused_connections': 0,
+                'total_time': 0.,
+            }
+        return self._host_stats[host]
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        # The callbacks run on the loop, so the metrics are only updated from its thread
+        async def on_request_start(_session, context, params):
+            context.host = params.url.host
+            context.start = time.monotonic()
+            self._host(context.host)['requests'] += 1
+
+        async def on_request_end(_session, context, _params):
+            self._host(context.host)['total_time'] += time.monotonic() - context.start
+
+        async def on_request_exception(_session, context, _params):
+            self._host(context.host)['errors'] += 1
+
+        async def on_connection_create_end(_session, context, _params):
+            self._host(context.host)['new_connections'] += 1
+
+        async def on_connection_reuseconn(_session, context, _params):
+            self._host(context.host)['reused_connections'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def session(self) -> aiohttp.ClientSession:
+        '''
+        Get the persistent session, to be used from coroutines running on the loop
+        Returns:
+            (ClientSession): The session, with a timeout of DEFAULT_TIMEOUT by default
+        '''
+        if self._session is None:
+            conn = aiohttp.TCPConnector(
+                limit_per_host=100, limit=0, ttl_dns_cache=300, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=conn, timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT),
+                raise_for_status=True, trace_configs=[self._trace_config()]
+            )
+            atexit.register(self._close)
+        return self._session
+
+    def _close(self):
+        if self._session is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(5)
+
+    def host_stats(self) -> dict[str, dict]:
+        '''
+        Get the connection metrics for each host
+        Returns:
+            (dict): For each host, number of requests, errors, new and reused connections,
+                and average request time in ms
+        '''
+        async def copy():
+            return {
+                host: {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'new_connections': stats['new_connections'],
+                    'reused_connections': stats['reused_connections'],
+                    'avg_time_ms': 0 if stats['requests'] == 0 else
+                        round(stats['total_time'] * 1000 / stats['requests'], 1),
+                }
+                for host, stats in sorted(self._host_stats.items())
+            }
+        return self.run(copy())
+
+
+_background_loop = BackgroundLoop()
+
+
+def run_async(coroutine):
+    '''
+    Run a coroutine on the shared background event loop and wait for its result
+    Args:
+        coroutine (coroutine): Coroutine to run
     Returns:
-        (AbstractEventLoop): Event loop
+        (any): Result of the coroutine
     '''
-    try:
-        return asyncio.get_event_loop()
-    except RuntimeError as ex:
-        if "There is no current event loop in thread" in str(ex):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return asyncio.get_event_loop()
-        raise ex
+    return _background_loop.run(coroutine)
 
 
-@asynccontextmanager
-async def get_aiohttp_session(timeout: int=DEFAULT_TIMEOUT) -> aiohttp.ClientSession:
+async def on_background_loop(coroutine):
     '''
-    Create a session for the asyncio connection
+    Run a coroutine on the shared background event loop, from a coroutine running on
+    another event loop, without blocking it
     Args:
-        timeout (int): Timeout to set for the session
+        coroutine (coroutine): Coroutine to run
     Returns:
-        (ClientSession): Yields the session and then closes it
+        (any): Result of the coroutine
     '''
-    try:
-        conn = aiohttp.TCPConnector(limit_per_host=100, limit=0, ttl_dns_cache=300)
-        aiohttp_timeout = aiohttp.ClientTimeout(total=timeout)
-        session = aiohttp.ClientSession(
-            connector=conn, timeout=aiohttp_timeout, raise_for_status=True
-        )
-        yield session
-    finally:
-        await session.close()
-        conn.close()
+    return await _background_loop.run_async(coroutine)
+
+
+def http_client_stats() -> dict[str, dict]:
+    '''
+    Get the metrics of the connections to each host from this process
+    Returns:
+        (dict): See BackgroundLoop.host_stats
+    '''
+    return _background_loop.host_stats()
+
+
+@asynccontextmanager
+async def get_aiohttp_session() -> aiohttp.ClientSession:
+    '''
+    Get the persistent session, from a coroutine running on the background loop
+    (see run_async). The session stays open for the next requests.
+    Returns:
+        (ClientSession): Yields the session
+    '''
+    yield _background_loop.session()
 
 
-async def async_single_get(session: aiohttp.ClientSession, url: str, convert_to_json: bool=False) -> str: # pylint: disable=line-too-long
+async def async_single_get(session: aiohttp.ClientSession, url: str, convert_to_json: bool=False, timeout: int=DEFAULT_TIMEOUT) -> str: # pylint: disable=line-too-long
     '''
     Perform a single GET request with the session
     Args:
         session (ClientSession): Session object to use
         url (str): URL to query
         covert_to_json (bool): if the response should be converted to JSON
+        timeout (int): Timeout for the request
     Returns:
         (str): Respone from the request
     '''
-    async with session.get(url) as response:
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
         text = await response.text()
         if convert_to_json:
             result = json.loads(text)
@@ -101,60 +239,284 @@ async def async_single_get(session: aiohttp.ClientSession, url: str, convert_to_
         return result
 
 
+async def _gather_get(urls: list[str], convert_to_json: bool, timeout: int) -> list:
+    # Runs on the background loop
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_REQUESTS)
+    session = _background_loop.session()
+    aiohttp_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def get(url):
+        async with semaphore:
+            async with session.get(url, ssl=False, timeout=aiohttp_timeout) as response:
+                text = await response.text()
+                if convert_to_json:
+                    return json.loads(text)
+                return text
+
+    return list(await asyncio.gather(*(get(url) for url in urls)))
+
+
 def multiple_get(urls: list[str], convert_to_json: bool=False, timeout: int=DEFAULT_TIMEOUT) -> list: # pylint: disable=line-too-long
     '''
-    Perform multiple GET requests
+    Perform multiple GET requests, with the persistent session of the background loop
     Args:
         urls (list): Urls to query
         convert_to_json (bool): If the response should be converted to JSON
         timeout (int): Timeout for each request
     '''
-    async def gather_with_concurrency():
-        semaphore = asyncio.Semaphore(MAX_PARALLEL_REQUESTS)
-        aiohttp_timeout = aiohttp.ClientTimeout(total=timeout)
-        session = aiohttp.ClientSession(
-            connector=conn, timeout=aiohttp_timeout, raise_for_status=True
-        )
+    return run_async(_gather_get(urls, convert_to_json, timeout))
+
+
+async def async_multiple_get(urls: list[str], convert_to_json: bool=False, timeout: int=DEFAULT_TIMEOUT) -> list: # pylint: disable=line-too-long
+    '''
+    Perform multiple GET requests from a coroutine running on another event loop
+    (like the ones serving the requests), see multiple_get
+    Args:
+        urls (list): Urls to query
+        convert_to_json (bool): If the response should be converted to JSON
+        timeout (int): Timeout for each request
+    '''
+    return await on_background_loop(_gather_get(urls, convert_to_json, timeout))
+
+async def _open_stream(url: str, timeout: int, headers: dict | None) -> aiohttp.ClientResponse:
+    # Runs on the background loop; the timeout applies to each read, not to the whole body
+    aiohttp_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    return await _background_loop.session().get(
+        url, ssl=False, timeout=aiohttp_timeout, headers=headers
+    )
+
+async def _release(response: aiohttp.ClientResponse):
+    # Runs on the background loop
+    response.release()
+
+async def async_stream_get(url: str, chunk_size: int=STREAM_CHUNK_SIZE, timeout: int=DEFAULT_TIMEOUT, headers: dict | None=None): # pylint: disable=line-too-long
+    '''
+    Stream the body of a GET request with the persistent session, from a coroutine running
+    on another event loop. Each chunk is read on the background loop when it is asked for,
+    so a large response is never held in memory.
+    Args:
+        url (str): URL to query
+        chunk_size (int): Maximum size of the chunks
+        timeout (int): Timeout to connect and for each read
+        headers (dict): Additional request headers
+    Returns:
+        (AsyncIterator): Yields the body in chunks of bytes
+    '''
+    response = await on_background_loop(_open_stream(url, timeout, headers))
+    try:
+        while True:
+            chunk = await on_background_loop(response.content.read(chunk_size))
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await on_background_loop(_release(response))
+
+class DBPool(): # pylint: disable=too-many-instance-attributes
+    '''
+    Process-wide, thread-safe pool of connections to the monitoring database.
+    Connections are checked when they have been idle for a while and reconnected
+    if the check fails (for instance after a Galera failover).
+    '''
+    def __init__(self, size: int):
+        self.size = size
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._last_used = {}
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._reconnects = 0
+        self._wait_total = 0.
+        self._wait_max = 0.
+
+    def _get_pool(self) -> db.ConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                # The password is only read once, when creating the pool
+                password_file = os.getenv('MARIADB_MONITORING_PASSWORD_FILE')
+                with open(password_file, 'r', encoding='UTF-8') as f:
+                    password = f.read().strip()
+                self._pool = db.ConnectionPool(
+                    pool_name='monitoring', pool_size=self.size, pool_reset_connection=True,
+                    user='monitoring', password=password, host='galera', database='monitoring'
+                )
+                del password
+            return self._pool
+
+    def _check(self, conn: db.Connection):
+        if time.monotonic() - self._last_used.get(id(conn), 0) < DB_VALIDATION_INTERVAL:
+            return
+        try:
+            conn.ping()
+        except db.Error:
+            conn.reconnect()
+            with self._lock:
+                self._reconnects += 1
+
+    def get_connection(self, timeout: int=DEFAULT_TIMEOUT) -> db.Connection:
+        '''
+        Get a connection from the pool, waiting for one to be available if needed
+        Args:
+            timeout (int): Maximum time to wait for a connection, in seconds
+        Returns:
+            (Connection): A healthy connection, to give back with release()
+        '''
+        pool = self._get_pool()
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=timeout) # pylint: disable=consider-using-with
+        wait = time.monotonic() - start
+        with self._lock:
+            self._waiting -= 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        if not acquired:
+            raise db.PoolError(f"No database connection available after {timeout} s")
+        try:
+            conn = pool.get_connection()
+        except db.Error:
+            self._slots.release()
+            raise
+        try:
+            self._check(conn)
+        except db.Error:
+            # Back to the pool, it will be checked again next time
+            conn.close()
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def release(self, conn: db.Connection):
+        '''
+        Give a connection back to the pool
+        Args:
+            conn (Connection): Connection from get_connection()
+        '''
+        self._last_used[id(conn)] = time.monotonic()
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        '''
+        Get metrics for the pool
+        Returns:
+            (dict): Pool size, connections in use, waiting threads, number of checkouts
+                and reconnections, average and maximum wait time in ms
+        '''
+        with self._lock:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'reconnects': self._reconnects,
+                'avg_wait_ms': 0 if self._checkouts == 0 else
+                    round(self._wait_total * 1000 / self._checkouts, 1),
+                'max_wait_ms': round(self._wait_max * 1000, 1),
+            }
+
+
+_db_pool = DBPool(DB_POOL_SIZE)
+
+
+def db_pool_stats() -> dict:
+    '''
+    Get metrics for the monitoring database connection pool of this process
+    Returns:
+        (dict): See DBPool.stats
+    '''
+    return _db_pool.stats()
 
-        async def get(url):
-            async with semaphore:
-                async with session.get(url, ssl=False) as response:
-                    text = await response.text()
-                    if convert_to_json:
-                        obj = json.loads(text)
-                    else:
-                        obj = text
-                    results[url] = obj
-
-        await asyncio.gather(*(get(url) for url in urls))
-        await session.close()
-
-    loop = get_eventloop()
-    conn = aiohttp.TCPConnector(limit_per_host=100, limit=0, ttl_dns_cache=300)
-    results = {}
-    loop.run_until_complete(gather_with_concurrency())
-    conn.close()
-    ordered_results = []
-    for url in urls:
-        ordered_results.append(results[url])
-    return ordered_results
 
 class DBConnection():
     '''
-    Open a database connection
+    Get a connection to the monitoring database from the pool
     '''
     def __init__(self):
         self.conn = None
 
     def __enter__(self):
-        with open(os.getenv('MARIADB_MONITORING_PASSWORD_FILE'), 'r', encoding='UTF-8') as f:
-            password = f.read().strip()
-        self.conn = db.connect(
-            user='monitoring', password=password, host='galera', database="monitoring"
-        )
-        del password
+        self.conn = _db_pool.get_connection()
         return self.conn
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.conn is not None:
-            self.conn.close()
+            _db_pool.release(self.conn)
+            self.conn = None
+
+
+class TTLCache():
+    '''
+    Cache for the result of a slow function without arguments.
+    A result younger than `ttl` is returned directly. An older result is still returned
+    for up to `max_stale` more seconds while a background thread computes a new one.
+    Concurrent callers share a single computation (single-flight), so the function is
+    called at most once per interval however many callers there are.
+    '''
+    def __init__(self, function, ttl: float, max_stale: float):
+        self._function = function
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._value = None
+        self._updated = None
+        self._refreshing = False
+        self._condition = threading.Condition()
+
+    def _age(self) -> float | None:
+        return None if self._updated is None else time.monotonic() - self._updated
+
+    def _refresh(self):
+        try:
+            value = self._function()
+            with self._condition:
+                self._value = value
+                self._updated = time.monotonic()
+        finally:
+            with self._condition:
+                self._refreshing = False
+                self._condition.notify_all()
+
+    def update(self):
+        '''
+        Compute the result now, unless it is already being computed
+        '''
+        with self._condition:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        self._refresh()
+
+    def get(self) -> tuple:
+        '''
+        Get the cached result, computing it if needed
+        Returns:
+            (tuple): Result, and its age in seconds
+        '''
+        with self._condition:
+            while True:
+                age = self._age()
+                if age is not None and age < self.ttl:
+                    return (self._value, age)
+                if age is not None and age < self.ttl + self.max_stale:
+                    if not self._refreshing:
+                        self._refreshing = True
+                        threading.Thread(target=self._refresh, daemon=True).start()
+                    return (self._value, age)
+                if not self._refreshing:
+                    break
+                # Another caller is computing the result
+                self._condition.wait()
+            self._refreshing = True
+        self._refresh()
+        with self._condition:
+            return (self._value, self._age())
@@ -0,0 +1,362 @@
+'''
+Load test of the monitoring dashboard with a stand-in for the database, to compare
+versions of the monitoring app (for instance before and after a change of web server).
+
+The app of the given git revision (default: the working tree) is started on this
+machine with the command of its Dockerfile, and with a stand-in for the mariadb module:
+each query takes a fixed time and returns rows shaped like the graph queries, so that
+the app does the same work on the results as in production. The dashboard is then
+requested by an increasing number of concurrent viewers, each one requesting it again
+as soon as it gets it.
+
+Run it from the repository, as root (the app listens on port 80):
+python3 monitoring/benchmark_dashboard.py --ref <commit>
+'''
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+import aiohttp
+
+
+CONCURRENCIES = [1, 5, 10, 25, 50, 100, 200]
+DURATION = 20
+QUERY_TIME = 0.05
+MAX_P95 = 2.0
+URL = 'http://127.0.0.1/monitoring/dashboard/day'
+REQUEST_TIMEOUT = 60
+START_TIMEOUT = 60
+STUB_MODULE = '''
+"""Stand-in for the mariadb module, see benchmark_dashboard.py"""
+import os
+import re
+import time
+from datetime import timedelta
+
+QUERY_TIME = float(os.environ['BENCHMARK_QUERY_TIME'])
+# Time between two rows of each table, for a node and a variable or route
+ROW_WIDTHS = {'': 60, '_hourly': 3600, '_daily': 86400, '_monthly': 28*86400}
+_histogram = None
+
+
+class Error(Exception):
+    pass
+
+
+class PoolError(Error):
+    pass
+
+
+def _encoded_histogram():
+    global _histogram
+    if _histogram is None:
+        from histogram import Histogram
+        histogram = Histogram()
+        for value in range(10000, 2000000, 5000):
+            histogram.record(value)
+        _histogram = histogram.encode()
+    return _histogram
+
+
+def _times(start, end, width):
+    time = start
+    while time < end:
+        yield time
+        time += timedelta(seconds=width)
+
+
+def _rows(query, params):
+    # Rows for the graph queries: the parameters are the width of the buckets, the
+    # nodes, the start and end of the window, and the variables or the route
+    match = re.search(r'FROM (route_data|data)(_hourly|_daily|_monthly)? WHERE node IN \\(([^)]*)\\)',
+                      query)
+    if not match or not query.startswith('SELECT'):
+        return []
+    n_nodes = match.group(3).count('%s')
+    width = params[0]
+    nodes = params[1:1 + n_nodes]
+    (start, end) = params[1 + n_nodes:3 + n_nodes]
+    rows = []
+    if match.group(1) == 'route_data':
+        for node in nodes:
+            for time in _times(start, end, ROW_WIDTHS[match.group(2) or '']):
+                bucket = int((time - start).total_seconds() // width)
+                rows.append((node, bucket, time, 40, 400000, 150, 2000, _encoded_histogram(), 1))
+    elif match.group(2) is None:
+        n_variables = len(re.findall(r'(?:AVG|MAX|MIN)\\(', query)) - 1
+        for node in nodes:
+            for time in _times(start, end, width):
+                bucket = int((time - start).total_seconds() // width)
+                rows.append((node, bucket, time) + (1.5,) * n_variables)
+    else:
+        for node in nodes:
+            for variable in params[3 + n_nodes:]:
+                for time in _times(start, end, max(width, ROW_WIDTHS[match.group(2)])):
+                    bucket = int((time - start).total_seconds() // width)
+                    rows.append((node, bucket, time, variable, 1.0, 2.0, 1.5))
+    return rows
+
+
+class Cursor:
+    def __init__(self):
+        self._rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+        self.description = None
+
+    def execute(self, query, params=()):
+        time.sleep(QUERY_TIME)
+        self._rows = _rows(query, list(params or ()))
+        self.rowcount = len(self._rows)
+
+    def executemany(self, query, params):
+        time.sleep(QUERY_TIME)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def cursor(self, *args, **kwargs):
+        return Cursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def reconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, **kwargs):
+        pass
+
+    def get_connection(self):
+        return Connection()
+
+
+def connect(**kwargs):
+    return Connection()
+'''
+
+
+def parse_args() -> argparse.Namespace:
+    '''
+    Parse the command line
+    Returns:
+        (Namespace): Arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description="Load test of the monitoring dashboard with a stand-in for the database"
+    )
+    parser.add_argument("-r", "--ref",
+                        help="Git revision of the app to test (default: the working tree)")
+    parser.add_argument("-c", "--concurrencies", type=int, nargs='+', default=CONCURRENCIES,
+                        help="Numbers of concurrent viewers (default: "
+                        f"{' '.join(str(c) for c in CONCURRENCIES)})")
+    parser.add_argument("-d", "--duration", type=float, default=DURATION,
+                        help=f"Seconds of load for each concurrency (default: {DURATION})")
+    parser.add_argument("-q", "--query-time", type=float, default=QUERY_TIME,
+                        help=f"Seconds taken by each database query (default: {QUERY_TIME})")
+    parser.add_argument("-p", "--max-p95", type=float, default=MAX_P95,
+                        help="95th percentile of the response time, in seconds, up to which "
+                        f"the viewers are considered served (default: {MAX_P95})")
+    return parser.parse_args()
+
+
+def export_app(ref: str | None, directory: str) -> str:
+    '''
+    Get the monitoring directory of a git revision
+    Args:
+        ref (str): Git revision, None for the working tree
+        directory (str): Temporary directory to extract it in
+    Returns:
+        (str): Path of the monitoring directory
+    '''
+    monitoring = os.path.dirname(os.path.abspath(__file__))
+    if ref is None:
+        return monitoring
+    archive = subprocess.run(
+        ['git', 'archive', ref, 'monitoring'], cwd=os.path.dirname(monitoring),
+        check=True, capture_output=True
+    ).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+    return os.path.join(directory, 'monitoring')
+
+
+def app_command(monitoring: str) -> list[str]:
+    '''
+    Get the command starting the app, from the Dockerfile
+    Args:
+        monitoring (str): Path of the monitoring directory
+    Returns:
+        (list[str]): Command
+    '''
+    with open(os.path.join(monitoring, 'Dockerfile'), 'r', encoding='UTF-8') as f:
+        for line in f:
+            if line.startswith('CMD '):
+                command = [part.strip(' "') for part in line[4:].strip(' []\n').split(',')]
+                return [sys.executable if command[0] == 'python' else command[0]] + command[1:]
+    raise ValueError('No CMD in the Dockerfile')
+
+
+async def wait_for_app(process: subprocess.Popen):
+    '''
+    Wait until the app serves the dashboard
+    Args:
+        process (Popen): Process of the app
+    '''
+    deadline = time.monotonic() + START_TIMEOUT
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('The app stopped, see its log')
+            try:
+                async with session.get(URL) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError('The app did not start')
+
+
+async def load(concurrency: int, duration: float) -> tuple[list[float], Counter, float]:
+    '''
+    Request the dashboard with concurrent viewers
+    Args:
+        concurrency (int): Number of concurrent viewers
+        duration (float): Duration of the load, in seconds
+    Returns:
+        (tuple): Response times of the successful requests, number of failures by cause
+            (HTTP status, error page or exception), and time until the last response, in seconds
+    '''
+    times = []
+    failures = Counter()
+    start_load = time.monotonic()
+    end = start_load + duration
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def viewer(session: aiohttp.ClientSession):
+        while time.monotonic() < end:
+            start = time.monotonic()
+            try:
+                async with session.get(URL) as response:
+                    body = await response.read()
+                    if response.status != 200:
+                        failures[f'HTTP {response.status}'] += 1
+                    elif not body.lstrip().startswith(b'<!DOCTYPE'):
+                        # Errors such as a database pool timeout are shown with a 200
+                        failures['error page'] += 1
+                    else:
+                        times.append(time.monotonic() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                failures[type(err).__name__] += 1
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(viewer(session) for _ in range(concurrency)))
+    return (times, failures, time.monotonic() - start_load)
+
+
+def percentile(values: list[float], percent: int) -> float:
+    '''
+    Get a percentile of a list of values
+    Args:
+        values (list[float]): Values
+        percent (int): Percentile
+    Returns:
+        (float): Value, 0 for an empty list
+    '''
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+async def report(args: argparse.Namespace):
+    '''
+    Load the app with each concurrency, and print the results
+    Args:
+        args (Namespace): Arguments
+    '''
+    print(f"{args.ref or 'working tree'}, {args.query_time * 1000:.0f} ms per query")
+    print("viewers  requests/s  p50 (s)  p95 (s)  failures")
+    served = 0
+    for concurrency in args.concurrencies:
+        (times, failures, elapsed) = await load(concurrency, args.duration)
+        p95 = percentile(times, 95)
+        causes = ', '.join(f'{cause}: {count}' for cause, count in failures.items())
+        print(f"{concurrency:7}  {len(times) / elapsed:10.1f}  "
+              f"{percentile(times, 50):7.2f}  {p95:7.2f}  {failures.total():8}"
+              + (f"  ({causes})" if causes else ''))
+        if not failures and times and p95 <= args.max_p95:
+            served = concurrency
+    print(f"Served: {served} concurrent viewers (no failure, p95 <= {args.max_p95} s)")
+
+
+async def run(args: argparse.Namespace):
+    '''
+    Start the app and load it with each concurrency
+    Args:
+        args (Namespace): Arguments
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        monitoring = export_app(args.ref, directory)
+        stub = os.path.join(directory, 'stub')
+        os.makedirs(stub)
+        with open(os.path.join(stub, 'mariadb.py'), 'w', encoding='UTF-8') as f:
+            f.write(STUB_MODULE)
+        password_file = os.path.join(directory, 'password')
+        with open(password_file, 'w', encoding='UTF-8') as f:
+            f.write('benchmark')
+        env = dict(
+            os.environ, PYTHONPATH=stub, NODE='1', STACK_NAME='benchmark-prod',
+            MARIADB_MONITORING_PASSWORD_FILE=password_file,
+            BENCHMARK_QUERY_TIME=str(args.query_time),
+            LOG_INDEX_DIR=os.path.join(directory, 'log_index'),
+        )
+        log_path = os.path.join(directory, 'app.log')
+        with open(log_path, 'w', encoding='UTF-8') as log:
+            process = subprocess.Popen( # pylint: disable=consider-using-with
+                app_command(monitoring), cwd=monitoring, env=env, stdout=log, stderr=log
+            )
+        try:
+            await wait_for_app(process)
+            await report(args)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    '''
+    Run the load test
+    '''
+    asyncio.run(run(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,95 @@
 #!/usr/bin/env python
 
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from itertools import islice
+import argparse
 import http.client
 import json
+import math
+import threading
 import time
+import urllib.parse
 
 BATCH_SIZE = 65536
+CONCURRENCY = 4
+CALL_NUMBERS_FILE = "/mnt/shared/call-numbers/call_numbers.csv"
+SOLR_HOST = "localhost:8983"
+# Solr can take a while to process a large batch
+TIMEOUT = 600
+# When the updates are committed:
+# - end: a single commit at the end (one new searcher)
+# - within: commitWithin on each request, Solr commits when it wants to
+# - soft: a soft commit after each batch (visible, not durable), and a commit at the end
+# - hard: a hard commit without a new searcher after each batch (durable, not visible),
+#   and a commit at the end
+# - batch: a commit with a new searcher after each batch (the old behavior)
+COMMIT_MODES = ['end', 'within', 'soft', 'hard', 'batch']
+COMMIT_MODE = 'end'
+COMMIT_WITHIN = 60000
 
 
 class StatusException(Exception):
     pass
 
 
-def read_results():
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Add the generated call numbers to callnumber-label in the biblio collection"
+    )
+    parser.add_argument("-f", "--file", default=CALL_NUMBERS_FILE,
+                        help=f"CSV file with the ids and call numbers (default: {CALL_NUMBERS_FILE})")
+    parser.add_argument("-s", "--solr", default=SOLR_HOST,
+                        help=f"Solr host and port (default: {SOLR_HOST})")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"Number of documents per update request (default: {BATCH_SIZE})")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                        help=f"Number of batches sent at the same time (default: {CONCURRENCY})")
+    parser.add_argument("-m", "--commit-mode", choices=COMMIT_MODES, default=COMMIT_MODE,
+                        help=f"When the updates are committed (default: {COMMIT_MODE})")
+    parser.add_argument("-w", "--commit-within", type=int, default=COMMIT_WITHIN,
+                        help=f"Milliseconds for commitWithin, with the within commit mode "
+                        f"(default: {COMMIT_WITHIN})")
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.concurrency < 1:
+        parser.error("batch size and concurrency must be at least 1")
+    if args.commit_within < 1:
+        parser.error("commit within must be at least 1 ms")
+    return args
+
+
+def read_results(filename):
     print("Read results")
-    filename = "/mnt/shared/call-numbers/call_numbers.csv"
     with open(filename, 'r', encoding='utf-8') as f:
         for line in f:
             parts = line.rstrip('\n').split(',')
             yield {"id": parts[0], "cn": parts[1]}
 
 
-def connect():
-    headers = {"Content-type": "application/json"}
-    conn = http.client.HTTPConnection('localhost:8983')
-    return conn, headers
+class Connections:
+    # One keep-alive connection per thread, reused for all its batches
+
+    def __init__(self, host, batch_params):
+        self.host = host
+        self.headers = {"Content-type": "application/json"}
+        # Query parameters of the batch requests
+        self.batch_params = batch_params
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, timeout=TIMEOUT)
+            self._local.conn = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
 
 
 def chunks(iterable, n):
@@ -33,6 +98,25 @@ def chunks(iterable, n):
         yield chunk
 
 
+def commit_params(mode, within):
+    # Parameters for the batches, and for the last request
+    if mode == 'within':
+        params = {"commitWithin": within}
+        return params, params
+    batch_params = {
+        'end': {},
+        'soft': {"softCommit": "true"},
+        'hard': {"commit": "true", "openSearcher": "false"},
+        'batch': {"commit": "true"},
+    }[mode]
+    return batch_params, {"commit": "true"}
+
+
+def update_path(params):
+    path = '/solr/biblio/update'
+    return f'{path}?{urllib.parse.urlencode(params)}' if params else path
+
+
 def check_status(resp):
     if resp.status != 200:
         print(f"\nUnexpected status: {resp.status} {resp.reason}\n")
@@ -41,32 +125,86 @@ def check_status(resp):
         raise StatusException(f"Unexpected status: {resp.status} {resp.reason}")
 
 
-def send_batch_to_solr(conn, headers, batch):
+def send_batch_to_solr(conn, headers, params, batch):
     update_objects = []
     for doc in batch:
         obj = {"id": doc['id'], "callnumber-label": {"add-distinct": doc['cn']}}
         update_objects.append(obj)
     query = json.dumps(update_objects, ensure_ascii=False)
-    path = '/solr/biblio/update?commit=true'
+    path = update_path(params)
     conn.request('POST', path, body=query, headers=headers)
     resp = conn.getresponse()
     check_status(resp)
     resp.read()
 
 
-def send_by_batch(docs, conn, headers):
-    print("Send by batch")
-    n = 0
-    for batch in chunks(docs, BATCH_SIZE):
-        n = n + 1
-        print(f"Batch number {n}", end='\r')
-        send_batch_to_solr(conn, headers, batch)
+def send_batch(connections, batch):
+    # Runs in a worker thread; returns the number of documents and the latency
+    conn = connections.get()
+    start = time.perf_counter()
+    try:
+        send_batch_to_solr(conn, connections.headers, connections.batch_params, batch)
+    except (http.client.HTTPException, OSError):
+        # Reconnect for the next batch
+        conn.close()
+        raise
+    return len(batch), time.perf_counter() - start
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)]
+
+
+def send_by_batch(docs, connections, batch_size, concurrency):
+    print(f"Send by batch ({concurrency} at a time)")
+    latencies = []
+    n_docs = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+
+        def collect(done):
+            nonlocal n_docs
+            for future in done:
+                # Raises the exception of a failed batch
+                n, latency = future.result()
+                n_docs += n
+                latencies.append(latency)
+
+        try:
+            batches = chunks(docs, batch_size)
+            n = 0
+            while True:
+                if len(in_flight) >= concurrency:
+                    # Backpressure: read the next batch only when one is done,
+                    # so that at most `concurrency` batches are in memory
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                n += 1
+                print(f"Batch number {n}", end='\r')
+                in_flight.add(executor.submit(send_batch, connections, batch))
+            done, in_flight = wait(in_flight)
+            collect(done)
+        finally:
+            for future in in_flight:
+                future.cancel()
+    elapsed = time.perf_counter() - start
     print("\n")
+    print(f"Sent {n_docs} documents in {len(latencies)} batches in {elapsed:.1f} s: "
+          f"{n_docs / elapsed if elapsed > 0 else 0:.0f} docs/s, "
+          f"p95 batch latency {percentile(latencies, 95):.2f} s")
 
 
-def remove_deleted_records(conn, headers):
+def remove_deleted_records(conn, headers, params):
+    # Last request, which also commits everything (except with commitWithin)
     print("Remove deleted records")
-    path = '/solr/biblio/update?commit=true'
+    path = update_path(params)
     query = json.dumps({"delete": {"query": "!(institution:*)"}})
     conn.request('POST', path, body=query, headers=headers)
     resp = conn.getresponse()
@@ -75,14 +213,16 @@ def remove_deleted_records(conn, headers):
 
 
 def main():
+    args = parse_args()
     start = time.perf_counter()
-    docs = read_results()
-    conn, headers = connect()
+    docs = read_results(args.file)
+    batch_params, final_params = commit_params(args.commit_mode, args.commit_within)
+    connections = Connections(args.solr, batch_params)
     try:
-        send_by_batch(docs, conn, headers)
-        remove_deleted_records(conn, headers)
+        send_by_batch(docs, connections, args.batch_size, args.concurrency)
+        remove_deleted_records(connections.get(), connections.headers, final_params)
     finally:
-        conn.close()
+        connections.close()
     end = time.perf_counter()
     print(f"\nDone. Execution time: {int(end - start)} s")
 
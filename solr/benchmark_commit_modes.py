@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# Compare the commit modes of add_generated_call_numbers.py against a local stand-in
+# for the Solr update handler, charging a fixed cost for indexing, hard commits and new
+# searchers. The numbers only show the relative cost of the commits, they are not
+# measurements on the SolrCloud cluster.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+DOCS = 200000
+BATCH_SIZE = 5000
+CONCURRENCY = 4
+COMMIT_WITHIN = 1000
+COMMIT_MODES = ['batch', 'soft', 'hard', 'within', 'end']
+# Costs charged by the stand-in, in seconds
+DOC_COST = 20e-6
+HARD_COMMIT_COST = 0.2
+SEARCHER_COST = 0.3
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "add_generated_call_numbers.py")
+
+
+class StandInSolr:
+    # Update handler counting the documents, commits and searchers.
+    # Commits are serialized like in Solr, and commitWithin starts a timer
+    # if none is pending.
+
+    def __init__(self):
+        self.stats = {}
+        self.reset()
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._timer = None
+
+    def reset(self):
+        self.stats = {'requests': 0, 'docs': 0, 'hard_commits': 0, 'soft_commits': 0,
+                      'searchers': 0}
+
+    def commit(self, hard, open_searcher):
+        with self._commit_lock:
+            if hard:
+                time.sleep(HARD_COMMIT_COST)
+                self.stats['hard_commits'] += 1
+            else:
+                self.stats['soft_commits'] += 1
+            if open_searcher:
+                time.sleep(SEARCHER_COST)
+                self.stats['searchers'] += 1
+
+    def commit_within(self, ms):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(ms / 1000, self._fire_timer)
+                self._timer.start()
+
+    def _fire_timer(self):
+        with self._lock:
+            self._timer = None
+        self.commit(False, True)
+
+    def wait_for_timer(self):
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.join()
+
+    def update(self, params, data):
+        if isinstance(data, list):
+            time.sleep(len(data) * DOC_COST)
+            with self._lock:
+                self.stats['docs'] += len(data)
+        with self._lock:
+            self.stats['requests'] += 1
+        if params.get('commit') == 'true':
+            self.commit(True, params.get('openSearcher', 'true') == 'true')
+        elif params.get('softCommit') == 'true':
+            self.commit(False, True)
+        elif 'commitWithin' in params:
+            self.commit_within(int(params['commitWithin']))
+
+
+def handler(solr):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            solr.update(params, data)
+            body = b'{"responseHeader":{"status":0}}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the commit modes of add_generated_call_numbers.py against a "
+        "local stand-in for the Solr update handler"
+    )
+    parser.add_argument("-n", "--docs", type=int, default=DOCS,
+                        help=f"Number of generated documents (default: {DOCS})")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"Number of documents per update request (default: {BATCH_SIZE})")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                        help=f"Number of batches sent at the same time (default: {CONCURRENCY})")
+    parser.add_argument("-w", "--commit-within", type=int, default=COMMIT_WITHIN,
+                        help=f"Milliseconds for commitWithin (default: {COMMIT_WITHIN})")
+    parser.add_argument("-m", "--commit-modes", nargs='+', choices=COMMIT_MODES,
+                        default=COMMIT_MODES,
+                        help=f"Commit modes to compare (default: {' '.join(COMMIT_MODES)})")
+    return parser.parse_args()
+
+
+def write_call_numbers(filename, n_docs):
+    with open(filename, 'w', encoding='utf-8') as f:
+        for i in range(n_docs):
+            f.write(f"id{i},QA{i}\n")
+
+
+def run(args, solr, host, filename, mode):
+    solr.reset()
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, SCRIPT, "-f", filename, "-s", host, "-b", str(args.batch_size),
+         "-c", str(args.concurrency), "-m", mode, "-w", str(args.commit_within)],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    # With commitWithin, the changes are only visible after the last pending commit
+    solr.wait_for_timer()
+    elapsed = time.perf_counter() - start
+    print(f"{mode:>6}: {elapsed:5.1f} s, {solr.stats['searchers']:3} searchers opened, "
+          f"{solr.stats['hard_commits']:3} hard commits, {solr.stats['requests']} requests")
+
+
+def main():
+    args = parse_args()
+    solr = StandInSolr()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler(solr))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"127.0.0.1:{server.server_address[1]}"
+    print(f"{args.docs} documents, batches of {args.batch_size}, concurrency "
+          f"{args.concurrency}, commitWithin {args.commit_within} ms")
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "call_numbers.csv")
+        write_call_numbers(filename, args.docs)
+        for mode in args.commit_modes:
+            run(args, solr, host, filename, mode)
+    server.shutdown()
+
+
+main()